@@ -1,21 +1,65 @@
+import argparse
+import os
 import sys
 
+from .exceptions import LoxCompileError, LoxRuntimeError
 from .ploxvm import Plox
-from .chunk import Chunk
-from .opcodes import *
-from .vm import VM
+from . import stream
 
 
-def usage(me):
-    print(f"Usage: {me} [script]")
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pLoxVM",
+        description="Run a Lox script, or start a REPL without one.")
+    parser.add_argument("script", nargs="?")
+    parser.add_argument("inputs", nargs="*",
+        help="with --stream, the files to read records from (default: stdin)")
+    parser.add_argument("--stream", action="store_true",
+        help="run the script once per input line, bound to `line`, its number to `NR`")
+    parser.add_argument("--fields", action="store_true",
+        help="with --stream, also split lines on whitespace into `fields` (from 1) and `NF`")
+    parser.add_argument("-F", "--separator",
+        help="with --stream, split lines into fields on this instead")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="with --stream, shard records across this many processes")
+    # Options may come after the script, between it and the inputs
+    args = parser.parse_intermixed_args(argv)
 
+    quota = os.environ.get("PLOXQUOTA")
+    quota = int(quota) if quota else None
+    infer = os.environ.get("PLOXINFER") == "1"
 
-if __name__ == "__main__":
-    lox = Plox()
+    if args.stream:
+        if args.script is None:
+            parser.error("--stream needs a script")
+
+        with open(args.script, encoding="utf8") as f:
+            source = f.read()
+
+        try:
+            stream.run_stream(source, args.inputs, args.fields or args.separator is not None,
+                args.separator, args.jobs, args.script, infer=infer, quota=quota)
+        except LoxCompileError as e:
+            print(e, file=sys.stderr)
+            return 65
+        except LoxRuntimeError as e:
+            print(e, file=sys.stderr)
+            return 70
+
+        return 0
+
+    if args.inputs:
+        parser.error("inputs are only read with --stream")
 
-    if len(sys.argv) == 1:
+    lox = Plox(profile=os.environ.get("PLOXPROFILE"), infer=infer, quota=quota,
+        memory_report=os.environ.get("PLOXMEMREPORT") == "1", coverage=os.environ.get("PLOXCOVERAGE"))
+
+    if args.script is None:
         lox.repl()
-    elif len(sys.argv) == 2:
-        lox.run_file(sys.argv[1])
     else:
-        usage(sys.argv[0])
+        lox.run_file(args.script)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
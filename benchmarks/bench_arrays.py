@@ -0,0 +1,44 @@
+import os
+import sys
+from contextlib import redirect_stdout
+from time import perf_counter
+
+from ..vm import VM
+
+
+LOOP = """\
+var a = array({size}, 1.5);
+var total = 0;
+for (var i = 0; i < {size}; i = i + 1) {{
+    total = total + get(a, i) * get(a, i);
+}}
+print total;
+"""
+
+BULK = """\
+var a = array({size}, 1.5);
+print dot(a, a);
+"""
+
+
+def run(source):
+    vm = VM()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        start = perf_counter()
+        vm.interpret(source)
+        return perf_counter() - start
+
+
+def main(sizes):
+    for size in sizes:
+        loop = run(LOOP.format(size=size))
+        bulk = run(BULK.format(size=size))
+        print(f"n={size:<8} loop {loop * 1e3:10.2f} ms  bulk {bulk * 1e3:8.2f} ms"
+            f"  x{loop / bulk:8.0f}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main([int(arg) for arg in sys.argv[1:]])
+    else:
+        main([10**3, 10**4, 10**5])
@@ -0,0 +1,42 @@
+import math
+import sys
+from time import perf_counter
+
+from ..vm import VM
+
+
+CHUNK = "x" * 64
+
+SOURCE = """\
+var s = "";
+for (var i = 0; i < {iterations}; i = i + 1) {{
+    s = s + "{chunk}";
+}}
+print s == s;
+"""
+
+
+def build_string(size):
+    vm = VM()
+    source = SOURCE.format(iterations=size // len(CHUNK), chunk=CHUNK)
+    start = perf_counter()
+    vm.interpret(source)
+    return perf_counter() - start
+
+
+def main(sizes):
+    timings = []
+    for size in sizes:
+        elapsed = build_string(size)
+        timings.append(elapsed)
+        print(f"{size // 1024:6} KiB  {elapsed:8.3f}s  {elapsed / size * 1e9:8.1f} ns/byte",
+            file=sys.stderr)
+
+    # Doubling the size should double the time, if concatenation is linear
+    (s0, t0), (s1, t1) = (sizes[0], timings[0]), (sizes[-1], timings[-1])
+    exponent = math.log(t1 / t0) / math.log(s1 / s0)
+    print(f"growth exponent: {exponent:.2f}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main([2**i * 1024 for i in range(6, 11)])
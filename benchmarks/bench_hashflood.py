@@ -0,0 +1,82 @@
+import sys
+from time import perf_counter
+from zlib import crc32
+
+from .. import hashmap
+from ..hashmap import HashMap
+
+
+TARGET = 0xDEADBEEF
+ZEROS = bytes(4)
+
+
+def suffix_basis():
+    # CRC32 is affine: the effect of the last 4 bytes on the checksum is a
+    # linear map of their bits, whatever came before them. Gaussian
+    # elimination over GF(2) gives a suffix for any checksum we want.
+    basis = {}
+    for bit in range(32):
+        suffix = (1 << bit).to_bytes(4, "little")
+        column, combo = crc32(suffix) ^ crc32(ZEROS), 1 << bit
+        while column:
+            top = column.bit_length() - 1
+            if top not in basis:
+                basis[top] = (column, combo)
+                break
+
+            column ^= basis[top][0]
+            combo ^= basis[top][1]
+
+    return basis
+
+
+def forge(prefix, target, basis):
+    """ Append 4 bytes to `prefix` so that its CRC32 is `target` """
+    wanted = target ^ crc32(prefix + ZEROS)
+    combo = 0
+    while wanted:
+        column, bits = basis[wanted.bit_length() - 1]
+        wanted ^= column
+        combo ^= bits
+
+    return prefix + combo.to_bytes(4, "little")
+
+
+def make_colliding_keys(n):
+    basis = suffix_basis()
+    keys = [forge(f"key_{i}".encode("ascii"), TARGET, basis) for i in range(n)]
+    assert all(crc32(key) == TARGET for key in keys)
+    return keys
+
+
+def bench(keys):
+    table = HashMap()
+    start = perf_counter()
+    for i, key in enumerate(keys):
+        table.insert(key, i)
+
+    for key in keys:
+        table.get(key)
+
+    return (perf_counter() - start) / (2 * len(keys))
+
+
+def main(sizes):
+    for n in sizes:
+        keys = make_colliding_keys(n)
+        for seed in (0, 0x5EED):
+            hashmap.set_hash_seed(seed)
+            elapsed = bench(keys)
+            label = "seeded" if seed else "crc32"
+            print(f"{label:8} n={n:<6} {elapsed * 1e6:10.2f} us/op", file=sys.stderr)
+
+    hashmap.set_hash_seed(hashmap.seed_from_environment())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sizes = [int(arg) for arg in sys.argv[1:]]
+    else:
+        sizes = [250, 500, 1000, 2000, 4000]
+
+    main(sizes)
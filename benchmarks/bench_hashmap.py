@@ -0,0 +1,125 @@
+import random
+import sys
+from time import perf_counter
+
+from ..hashmap import HashMap
+
+
+def make_keys(n, seed=0):
+    rnd = random.Random(seed)
+    keys = [f"key_{i}".encode("ascii") for i in range(n)]
+    rnd.shuffle(keys)
+    return keys
+
+
+def make_clustered_hashes(n, seed=0):
+    # Hashes sharing their low bits pile up on a few home slots
+    rnd = random.Random(seed)
+    hashes = [i << 6 for i in range(n)]
+    rnd.shuffle(hashes)
+    return hashes
+
+
+def bench_insert(keys, byhash):
+    table = HashMap()
+    start = perf_counter()
+    for i, key in enumerate(keys):
+        table.insert(key, i, byhash=byhash)
+
+    return perf_counter() - start, table
+
+
+def bench_lookup(table, keys, byhash):
+    start = perf_counter()
+    for key in keys:
+        table.get(key, byhash=byhash)
+
+    return perf_counter() - start
+
+
+def bench_delete(table, keys, byhash):
+    start = perf_counter()
+    for key in keys:
+        table.remove(key, byhash=byhash)
+
+    return perf_counter() - start
+
+
+def bench_churn(keys, byhash, seed=0):
+    # Keep the table at a steady size while replacing its contents
+    rnd = random.Random(seed)
+    half = len(keys) // 2
+    table = HashMap()
+    for i in range(half):
+        table.insert(keys[i], i, byhash=byhash)
+
+    start = perf_counter()
+    for i in range(half, len(keys)):
+        table.remove(keys[rnd.randrange(i)], byhash=byhash)
+        table.insert(keys[i], i, byhash=byhash)
+        table.get(keys[rnd.randrange(i + 1)], byhash=byhash)
+
+    return perf_counter() - start
+
+
+def bench_latency(keys, incremental):
+    table = HashMap(incremental=incremental)
+    latencies = []
+    for i, key in enumerate(keys):
+        start = perf_counter()
+        table.insert(key, i)
+        latencies.append(perf_counter() - start)
+
+    latencies.sort()
+    return latencies
+
+
+def run(keys, absent, byhash):
+    n = len(keys)
+    elapsed, table = bench_insert(keys, byhash)
+    return {
+        "insert": elapsed / n,
+        "lookup": bench_lookup(table, keys, byhash) / n,
+        "miss": bench_lookup(table, absent, byhash) / len(absent),
+        "delete": bench_delete(table, keys, byhash) / n,
+        "churn": bench_churn(keys, byhash) / (n - n // 2),
+    }
+
+
+def report(label, n, keys, absent, byhash, repeats):
+    # Best of a few runs, the slower ones are mostly noise
+    results = [run(keys, absent, byhash) for _ in range(repeats)]
+    for name in results[0]:
+        best = min(result[name] for result in results)
+        print(f"{label + ' ' + name:16} n={n:<8} {best * 1e9:10.0f} ns/op", file=sys.stderr)
+
+
+def report_latency(n, keys):
+    # What matters here is the worst case, which is what resizing hurts
+    for incremental in (False, True):
+        latencies = bench_latency(keys, incremental)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[len(latencies) * 99 // 100]
+        label = "incremental" if incremental else "stop-the-world"
+        print(f"{label:16} n={n:<8} p50 {p50 * 1e6:8.2f} us  p99 {p99 * 1e6:8.2f} us"
+            f"  max {latencies[-1] * 1e6:10.2f} us", file=sys.stderr)
+
+
+def main(sizes, repeats=3):
+    for n in sizes:
+        keys = make_keys(n)
+        absent = [b"absent_" + key for key in keys]
+        report("keys", n, keys, absent, False, repeats)
+
+        hashes = make_clustered_hashes(2 * n)
+        report("clustered", n, hashes[:n], hashes[n:], True, repeats)
+        report_latency(n, keys)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sizes = [int(arg) for arg in sys.argv[1:]]
+    else:
+        sizes = [10**3, 10**4, 10**5, 10**6]
+
+    main(sizes)
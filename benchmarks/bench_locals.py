@@ -0,0 +1,44 @@
+import sys
+from time import perf_counter
+
+from .. import chunk
+from ..vm import VM
+
+
+def program(total, width):
+    """ `total` locals, in blocks of `width`, each one read by the next few """
+    lines = []
+    for block in range(total // width):
+        lines.append("{")
+        lines.append("var l0 = 1;")
+        for i in range(1, width):
+            lines.append(f"var l{i} = l{i - 1} + l{i // 2} + l{i // 3};")
+
+        lines.append("}")
+
+    return "\n".join(lines)
+
+
+def compile_time(source, repeat=3):
+    vm = VM()
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        vm.compiler.compile(source, chunk.Chunk())
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main(total, widths):
+    for width in widths:
+        elapsed = compile_time(program(total, width))
+        # Three reads and a declaration per local
+        print(f"{total} locals in blocks of {width:<4} {elapsed * 1e3:8.2f} ms"
+            f"  {elapsed / (total * 4) * 1e6:6.2f} us/reference", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    main(total, [10, 50, 100, 250])
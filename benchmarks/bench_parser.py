@@ -0,0 +1,46 @@
+import random
+import sys
+from time import perf_counter
+
+from .. import chunk
+from ..vm import VM
+
+
+def expression(rnd, names, depth=0):
+    if depth > 3 or rnd.random() < 0.25:
+        return rnd.choice(names + ["1", "2.5", "true", "nil"])
+
+    if rnd.random() < 0.1:
+        return f"-({expression(rnd, names, depth + 1)})"
+
+    op = rnd.choice(["+", "-", "*", "/", "<", ">=", "==", "!=", "and", "or"])
+    return f"({expression(rnd, names, depth + 1)} {op} {expression(rnd, names, depth + 1)})"
+
+
+def program(statements, seed=0):
+    """ Expression statements over a few globals, `statements` of them """
+    rnd = random.Random(seed)
+    names = ["a", "b", "c", "d"]
+    lines = [f"var {name} = 1;" for name in names]
+    for _ in range(statements):
+        lines.append(f"{rnd.choice(names)} = {expression(rnd, names)};")
+
+    return "\n".join(lines)
+
+
+def main(statements, repeat=5):
+    source = program(statements)
+    vm = VM()
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        vm.compiler.compile(source, chunk.Chunk())
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f"{statements} statements, {len(source) / 1024:.0f} KiB: {best * 1e3:.2f} ms,"
+        f" {len(source) / best / 1024:.0f} KiB/s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
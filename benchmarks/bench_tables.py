@@ -0,0 +1,67 @@
+import sys
+from time import perf_counter
+
+from ..hashmap import BACKENDS
+from ..vm import VM
+
+
+# Mostly reads of a few hot globals, some writes, the odd definition:
+# what scripts without functions do to the globals table
+SOURCE = """\
+var total = 0;
+var step = 1;
+var limit = {iterations};
+for (var i = 0; i < limit; i = i + 1) {{
+    total = total + step;
+}}
+{definitions}
+print total;
+"""
+
+
+def make_source(iterations, definitions):
+    # Left nil, each one costs a single constant, its name: past 256 of them,
+    # the names are reached through the _LONG instructions
+    defs = "\n".join(f"var global_{i};" for i in range(definitions))
+    return SOURCE.format(iterations=iterations, definitions=defs)
+
+
+def bench_script(table, source):
+    vm = VM(table)
+    start = perf_counter()
+    vm.interpret(source)
+    return perf_counter() - start
+
+
+def bench_accesses(table, names, rounds):
+    # The very calls OP_GET_GLOBAL and OP_SET_GLOBAL make, without the VM around them
+    vm = VM(table)
+    keys = [vm.strings.intern(name) for name in names]
+    globals_ = vm.globals
+    for key in keys:
+        globals_.insert(key, 0.0)
+
+    start = perf_counter()
+    for _ in range(rounds):
+        for key in keys:
+            globals_.insert(key, globals_.get(key))
+
+    return (perf_counter() - start) / (2 * rounds * len(keys))
+
+
+def main(iterations, definitions, repeats=3):
+    source = make_source(iterations, definitions)
+    names = [f"global_{i}" for i in range(definitions)]
+    for table in BACKENDS:
+        elapsed = min(bench_script(table, source) for _ in range(repeats))
+        print(f"{table:8} script   {elapsed:8.3f}s", file=sys.stderr)
+
+        elapsed = min(bench_accesses(table, names, 100) for _ in range(repeats))
+        print(f"{table:8} accesses {elapsed * 1e9:8.0f} ns/op", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(*(int(arg) for arg in sys.argv[1:]))
+    else:
+        main(100_000, 200)
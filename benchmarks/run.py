@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+from contextlib import redirect_stdout
+from pathlib import Path
+from time import perf_counter
+
+from ..dispatcher import Instructions
+from ..enums import VMResult
+from ..vm import VM
+
+
+HERE = Path(__file__).parent
+BASELINE = HERE / "baseline.json"
+
+
+class CountingInstructions(Instructions):
+    def __init__(self):
+        self.executed = 0
+
+    def dispatch(self, instr_name, vm):
+        self.executed += 1
+        return super().dispatch(instr_name, vm)
+
+
+def run_once(source, vm):
+    # Whatever the programs print is not what we're measuring
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        start = perf_counter()
+        result = vm.interpret(source)
+        elapsed = perf_counter() - start
+
+    if result is VMResult.COMPILE_ERROR or result is VMResult.RUNTIME_ERROR:
+        raise RuntimeError(result)
+
+    return elapsed
+
+
+def count_instructions(source):
+    # A separate pass, so that counting doesn't weigh on the timings
+    vm = VM()
+    vm.instructions = CountingInstructions()
+    run_once(source, vm)
+    return vm.instructions.executed
+
+
+def measure(path, repeats):
+    source = path.read_text(encoding="utf8")
+    timings = [run_once(source, VM()) for _ in range(repeats)]
+    median = statistics.median(timings)
+    instructions = count_instructions(source)
+    return {
+        "median": median,
+        "min": min(timings),
+        "stdev": statistics.stdev(timings) if repeats > 1 else 0.0,
+        "instructions": instructions,
+        "ips": instructions / median,
+    }
+
+
+def compare(results, baseline, threshold):
+    """ Print how each benchmark moved against the baseline, return the regressions """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:16} not in baseline")
+            continue
+
+        change = result["median"] / baseline[name]["median"] - 1
+        verdict = ""
+        if change > threshold:
+            verdict = "REGRESSION"
+            regressions.append(name)
+
+        print(f"{name:16} {change:+8.1%} {verdict}")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks.run",
+        description="Run the Lox benchmark suite and compare it to a baseline.")
+    parser.add_argument("names", nargs="*", help="benchmarks to run (default: all)")
+    parser.add_argument("-n", "--repeats", type=int, default=5)
+    parser.add_argument("-b", "--baseline", type=Path, default=BASELINE)
+    parser.add_argument("-t", "--threshold", type=float, default=0.10,
+        help="relative slowdown of the median counted as a regression")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    args = parser.parse_args(argv)
+
+    paths = sorted(HERE.glob("*.lox"))
+    if args.names:
+        paths = [path for path in paths if path.stem in args.names]
+
+    results = {}
+    for path in paths:
+        result = measure(path, args.repeats)
+        results[path.stem] = result
+        print(f"{path.stem:16} {result['median'] * 1e3:9.1f} ms  ±{result['stdev'] * 1e3:6.1f}"
+            f"  min {result['min'] * 1e3:9.1f} ms  {result['ips'] / 1e6:6.2f} Minstr/s")
+
+    if args.save:
+        args.baseline.write_text(json.dumps(results, indent=4) + "\n", encoding="utf8")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --save to create one")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf8"))
+    regressions = compare(results, baseline, args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
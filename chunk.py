@@ -1,7 +1,16 @@
 from array import array
+from copy import copy
 from . import debug, value
 
 
+def _constant_key(value):
+    # Floats by their exact bits: 0 and -0 are equal, but not the same constant
+    if isinstance(value, float):
+        return (float, value.hex())
+
+    return value
+
+
 class Chunk:
     def __init__(self):
         self.constants = value.ValueArray()
@@ -10,19 +19,84 @@ class Chunk:
     def init(self):
         self.code = array('B')
         self.lines = array('i')
+        # Per instruction, how close it is to being specialized
+        self.counters = array('h')
+        # Per specialized instruction, what its guard checks against
+        self.caches = {}
         self._count = 0
         self.constants.init()
+        # Constant -> its index, so that each one is only stored once
+        self.constant_slots = {}
+        # Stack depth the code needs at most, once verified
+        self.max_depth = None
 
     def write(self, byte, line):
         self.code.append(int(byte) & 0xFF)
         self.lines.append(line)
+        self.counters.append(0)
         self._count += 1
 
     def add_constant(self, value):
-        pos = self.constants.count
-        self.constants.write(value)
+        key = _constant_key(value)
+        pos = self.constant_slots.get(key)
+        if pos is None:
+            pos = self.constants.count
+            self.constants.write(value)
+            self.constant_slots[key] = pos
+
         return pos
 
+    def freeze(self):
+        """ Make the chunk read-only, so that any number of VMs can share it.
+
+        They run `instance`s of it, since quickening rewrites the code.
+        """
+        self.code = bytes(self.code)
+        self.lines = memoryview(self.lines).toreadonly()
+        self.constants.values = tuple(self.constants.values)
+        self.counters = None
+        self.caches = None
+
+    def instance(self):
+        """ A copy to run, with its own code and instruction caches """
+        inst = copy(self)
+        inst.code = array('B', self.code)
+        inst.counters = array('h', [0]) * self._count
+        inst.caches = {}
+        return inst
+
+    def dump(self):
+        """ The code, lines and constants, as bytes and a list """
+        return bytes(self.code), self.lines.tobytes(), list(self.constants.values)
+
+    @classmethod
+    def load(cls, code, lines, constants):
+        """ The chunk `dump` returned these for, never run yet """
+        cnk = cls()
+        cnk.code.frombytes(code)
+        cnk.lines.frombytes(lines)
+        cnk.counters = array('h', [0]) * len(cnk.code)
+        cnk._count = len(cnk.code)
+        for value in constants:
+            cnk.add_constant(value)
+
+        return cnk
+
+    def mark(self):
+        """ Where the code and constants end, to roll back to """
+        return self._count, self.constants.count
+
+    def rollback(self, mark):
+        """ Drop whatever was written since `mark` was taken """
+        count, nconstants = mark
+        del self.code[count:]
+        del self.lines[count:]
+        del self.counters[count:]
+        self._count = count
+        self.caches = {site: cache for site, cache in self.caches.items() if site < count}
+        self.constants.truncate(nconstants)
+        self.constant_slots = {key: pos for key, pos in self.constant_slots.items() if pos < nconstants}
+
     def disassemble(self, name):
         return debug.disassemble(self, name)
 
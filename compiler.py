@@ -1,15 +1,14 @@
 from contextlib import contextmanager
 
+from .enums import StaticType
 from .error_machinery import ErrorMachinery
 from .opcodes import *
 from .scanner import TokenType
 from .precedence import Precedence
-from . import compiler, hashmap, pratt, scanner, types, value
+from . import compiler, pratt, scanner, value
 from . import debug
 
 
-errmac = ErrorMachinery()
-
 BINARY_OPS = {
     TokenType.PLUS: (OP_ADD,),
     TokenType.MINUS: (OP_SUBTRACT,),
@@ -23,6 +22,30 @@ BINARY_OPS = {
     TokenType.LESS_EQUAL: (OP_GREATER, OP_NOT),
 }
 
+# Instructions with no operand checks, when both operands are of the given type
+UNCHECKED_OPS = {
+    (OP_ADD, StaticType.NUMBER): OP_ADD_NUM_UNCHECKED,
+    (OP_ADD, StaticType.STRING): OP_ADD_STR_UNCHECKED,
+    (OP_SUBTRACT, StaticType.NUMBER): OP_SUBTRACT_UNCHECKED,
+    (OP_MULTIPLY, StaticType.NUMBER): OP_MULTIPLY_UNCHECKED,
+    (OP_DIVIDE, StaticType.NUMBER): OP_DIVIDE_UNCHECKED,
+    (OP_GREATER, StaticType.NUMBER): OP_GREATER_UNCHECKED,
+    (OP_LESS, StaticType.NUMBER): OP_LESS_UNCHECKED,
+}
+
+# What instructions with a constant operand become past the 256th constant
+LONG_OPS = {
+    OP_CONSTANT: OP_CONSTANT_LONG,
+    OP_GET_GLOBAL: OP_GET_GLOBAL_LONG,
+    OP_GET_GLOBAL_CACHED: OP_GET_GLOBAL_LONG,
+    OP_DEFINE_GLOBAL: OP_DEFINE_GLOBAL_LONG,
+    OP_SET_GLOBAL: OP_SET_GLOBAL_LONG,
+    OP_IMPORT: OP_IMPORT_LONG,
+}
+
+# Inference gives up, and leaves the checks everywhere, if it hasn't settled by then
+MAX_INFERENCE_PASSES = 8
+
 SYNC_TOKENS = {
     TokenType.CLASS,
     TokenType.FUN,
@@ -31,10 +54,16 @@ SYNC_TOKENS = {
     TokenType.IF,
     TokenType.WHILE,
     TokenType.PRINT,
-    TokenType.RETURN
+    TokenType.RETURN,
+    TokenType.IMPORT
 }
 
 
+def join(a, b):
+    # None stands for any type
+    return a if a is b else None
+
+
 class VariablesManager:
     def parse_variable(self, message):
         pass
@@ -50,7 +79,7 @@ class Emitter:
 
     def emit_constant(self, value):
         pos = self._make_constant(value)
-        self.emit_bytes(OP_CONSTANT, pos)
+        self.emit_operand(OP_CONSTANT, pos)
 
     def emit_return(self):
         self.emit_byte(OP_RETURN)
@@ -62,6 +91,12 @@ class Emitter:
         for byte in args:
             self.emit_byte(byte)
 
+    def emit_operand(self, opcode, operand):
+        if operand <= 255:
+            self.emit_bytes(opcode, operand)
+        else:
+            self.emit_bytes(LONG_OPS[opcode], (operand >> 8) & 0xFF, operand & 0xFF)
+
     def emit_loop(self, loop_start):
         self.emit_byte(OP_LOOP)
         offset = self.chunk.count - loop_start + 2
@@ -87,22 +122,77 @@ class Emitter:
 
     def _make_constant(self, value):
         constant = self.chunk.add_constant(value)
-        if constant > 255:
+        if constant > 65535:
             self._error("Too many constants in one chunk.")
             return 0
 
         return constant
 
 class Compiler(Emitter):
-    def __init__(self):
+    def __init__(self, strings, profile=None, infer=False, errors=None):
         super().__init__()
         self.scanner = scanner.Scanner()
-        self.strings = hashmap.HashMap()
+        self.strings = strings
+        # Shared with the VM compiling through us, if any
+        self.errors = errors if errors is not None else ErrorMachinery()
+        self.print_code = debug.PRINT_CODE
+        # Type feedback from earlier runs, to specialize instructions right away
+        self.profile = profile
+        self.infer = infer
         self.locals = value.Locals()
         self.previous = None
         self.current = None
+        # The parse rules, bound to this compiler once and for all
+        self.prefix_rules = tuple(name and getattr(self, f"_{name}") for name in pratt.PREFIX)
+        self.infix_rules = tuple(name and getattr(self, f"_{name}") for name in pratt.INFIX)
+        # Type inference: the static type of the last compiled expression,
+        # and per local (numbered in declaration order) the types assumed
+        # for this pass and the ones actually stored in it
+        self.inferring = False
+        self.expr_type = None
+        self.local_ids = []
+        self.declared = 0
+        self.assumed = {}
+        self.observed = {}
 
     def compile(self, source, cnk):
+        """ Compile `source` into `cnk`, in several passes when inferring types.
+
+        Each pass assumes the types of locals the previous one observed,
+        until they agree: the inferred types then hold for every value
+        stored in each local, loops included.
+        """
+        # Passes that didn't settle are dropped, whatever `cnk` held before is kept
+        mark = cnk.mark()
+        if not self.infer:
+            return self._compile(source, cnk)
+
+        self.inferring = True
+        self.assumed = {}
+        try:
+            for _ in range(MAX_INFERENCE_PASSES):
+                if not self._compile(source, cnk):
+                    return False
+
+                if self.observed == self.assumed:
+                    return True
+
+                self.assumed = self.observed
+                cnk.rollback(mark)
+        finally:
+            self.inferring = False
+
+        cnk.rollback(mark)
+        return self._compile(source, cnk)
+
+    def _compile(self, source, cnk):
+        self.observed = {}
+        self.local_ids = []
+        self.declared = 0
+        # Whatever an erroneous source left open, compilation starts at the top level
+        self.locals = value.Locals()
+        # Paths of the modules imported, as written
+        self.imports = []
         self.scanner.init(source)
         self.chunk = cnk
         self._advance()
@@ -114,7 +204,7 @@ class Compiler(Emitter):
         # self._consume(TokenType.EOF, "Expect end of expression.")
 
         self._end_compiler()
-        return not errmac.errored
+        return not self.errors.errored
 
     def _advance(self):
         self.previous = self.current
@@ -148,10 +238,24 @@ class Compiler(Emitter):
             self._expression()
         else:
             self.emit_byte(OP_NIL)
+            self.expr_type = StaticType.NIL
+
+        if self.locals.scope_depth > 0:
+            self._observe(self.local_ids[-1], self.expr_type)
 
         self._consume(TokenType.SEMICOLON, "Expect ';' after variable declaration.")
         self._define_variable(globvar)
 
+    def _statement_import(self):
+        if self.locals.scope_depth > 0:
+            self._error("Can only import at top level.")
+
+        self._consume(TokenType.STRING, "Expect module path after 'import'.")
+        path = self.strings.intern(self.previous.lexeme[1:-1])
+        self.imports.append(str(path))
+        self._consume(TokenType.SEMICOLON, "Expect ';' after import.")
+        self.emit_operand(OP_IMPORT, self._make_constant(path))
+
     def _statement_expression(self):
         self._expression()
         self._consume(TokenType.SEMICOLON, "Expect ';' after expression.")
@@ -228,22 +332,20 @@ class Compiler(Emitter):
         self.locals.scope_depth += 1
         yield
         self.locals.scope_depth -= 1
-        # FIXME: Make this more pythonic
         while self.locals.count > 0 and self.locals.depth[self.locals.count - 1] > self.locals.scope_depth:
             self.emit_byte(OP_POP)
-            self.locals.locals.pop()
-            self.locals.count -= 1
-
-        if self.locals.scope_depth == 0:
-            self.locals.depth = []
+            self.locals.pop()
+            self.local_ids.pop()
 
     def _declaration(self):
         if self._match(TokenType.VAR):
             self._statement_var()
+        elif self._match(TokenType.IMPORT):
+            self._statement_import()
         else:
             self._statement()
 
-        if errmac.panic_mode:
+        if self.errors.panic_mode:
             self._synchronize()
 
     def _statement(self):
@@ -264,30 +366,22 @@ class Compiler(Emitter):
     def _number(self, can_assign):
         value = float(self.previous.lexeme)
         self.emit_constant(value)
+        self.expr_type = StaticType.NUMBER
 
     def _string(self, can_assign):
         string = self.previous.lexeme[1:-1]
-        inst = self.strings.get(string)
-        if inst is None:
-            inst = types.LoxString(string)
-            self.strings.insert(inst.hash, inst, byhash=True)
-
-        self.emit_constant(inst)
+        self.emit_constant(self.strings.intern(string))
+        self.expr_type = StaticType.STRING
 
     def _variable(self, can_assign):
         self._named_variable(self.previous, can_assign)
 
     def _resolve_local(self, name):
-        # FIXME: Make this more pythonic
-        for i in range(self.locals.count - 1, -1, -1):
-            localname = self.locals.locals[i]
-            if name.length == localname.length and name.lexeme == localname.lexeme:
-                if self.locals.depth[i] == -1:
-                    self._error("Can't read local variable in its own initializer.")
+        slot = self.locals.resolve(name.lexeme)
+        if slot != -1 and self.locals.depth[slot] == -1:
+            self._error("Can't read local variable in its own initializer.")
 
-                return i
-
-        return -1
+        return slot
 
     def _named_variable(self, name, can_assign):
         arg = self._resolve_local(name)
@@ -302,63 +396,132 @@ class Compiler(Emitter):
 
         if can_assign and self._match(TokenType.EQUAL):
             self._expression()
-            self.emit_bytes(opcode_set, arg)
+            self.emit_operand(opcode_set, arg)
+            if opcode_set == OP_SET_LOCAL:
+                self._observe(self.local_ids[arg], self.expr_type)
         else:
-            self.emit_bytes(opcode_get, arg)
+            self.emit_operand(self._specialized(opcode_get), arg)
+            # Globals can be anything
+            self.expr_type = self._local_type(self.local_ids[arg]) if opcode_get == OP_GET_LOCAL else None
 
     def _and_(self, can_assign):
+        left = self.expr_type
         end_jump = self.emit_jump(OP_JUMP_IF_FALSE)
         self.emit_byte(OP_POP)
         self._parse_precedence(Precedence.AND)
         self.patch_jump(end_jump)
+        self.expr_type = join(left, self.expr_type)
 
     def _or_(self, can_assign):
+        left = self.expr_type
         else_jump = self.emit_jump(OP_JUMP_IF_FALSE)
         end_jump = self.emit_jump(OP_JUMP)
         self.patch_jump(else_jump)
         self.emit_byte(OP_POP)
         self._parse_precedence(Precedence.OR)
         self.patch_jump(end_jump)
+        self.expr_type = join(left, self.expr_type)
 
     def _binary(self, can_assign):
+        left = self.expr_type
         operator_type = self.previous.type
-        rule = pratt.RULES.get(operator_type)
         opcodes = BINARY_OPS.get(operator_type)
-        self._parse_precedence(rule.precedence + 1)
-        self.emit_bytes(*opcodes)
+        self._parse_precedence(pratt.PRECEDENCE[operator_type] + 1)
+        right = self.expr_type
+
+        opcode = opcodes[0]
+        if self.inferring and left is right and (opcode, left) in UNCHECKED_OPS:
+            self.emit_bytes(UNCHECKED_OPS[opcode, left], *opcodes[1:])
+        else:
+            self.emit_bytes(self._specialized(opcode), *opcodes[1:])
+
+        # Past the instruction, the operands were right or the script is over
+        if opcode == OP_ADD:
+            if StaticType.NUMBER in (left, right):
+                self.expr_type = StaticType.NUMBER
+            elif StaticType.STRING in (left, right):
+                self.expr_type = StaticType.STRING
+            else:
+                self.expr_type = None
+        elif opcode in (OP_SUBTRACT, OP_MULTIPLY, OP_DIVIDE):
+            self.expr_type = StaticType.NUMBER
+        else:
+            self.expr_type = StaticType.BOOL
+
+    def _call(self, can_assign):
+        arg_count = self._argument_list()
+        self.emit_bytes(OP_CALL, arg_count)
+        # Natives can return anything
+        self.expr_type = None
+
+    def _argument_list(self):
+        arg_count = 0
+        if not self._check(TokenType.RIGHT_PAREN):
+            while True:
+                self._expression()
+                if arg_count == 255:
+                    self._error("Can't have more than 255 arguments.")
+
+                arg_count += 1
+                if not self._match(TokenType.COMMA):
+                    break
+
+        self._consume(TokenType.RIGHT_PAREN, "Expect ')' after arguments.")
+        return arg_count
+
+    def _index(self, can_assign):
+        self._expression()
+        self._consume(TokenType.RIGHT_BRACKET, "Expect ']' after index.")
+        if can_assign and self._match(TokenType.EQUAL):
+            self._expression()
+            self.emit_byte(OP_SET_INDEX)
+        else:
+            self.emit_byte(OP_GET_INDEX)
+            # Maps hold anything
+            self.expr_type = None
 
     def _literal(self, can_assign):
         operator_type = self.previous.type
 
         if operator_type is TokenType.NIL:
             self.emit_byte(OP_NIL)
+            self.expr_type = StaticType.NIL
         elif operator_type is TokenType.FALSE:
             self.emit_byte(OP_FALSE)
+            self.expr_type = StaticType.BOOL
         elif operator_type is TokenType.TRUE:
             self.emit_byte(OP_TRUE)
+            self.expr_type = StaticType.BOOL
 
     def _unary(self, can_assign):
         operator_type = self.previous.type
 
         self._parse_precedence(Precedence.UNARY)
         if operator_type is TokenType.MINUS:
-            self.emit_byte(OP_NEGATE)
+            if self.inferring and self.expr_type is StaticType.NUMBER:
+                self.emit_byte(OP_NEGATE_UNCHECKED)
+            else:
+                self.emit_byte(OP_NEGATE)
+
+            self.expr_type = StaticType.NUMBER
         elif operator_type is TokenType.BANG:
             self.emit_byte(OP_NOT)
+            self.expr_type = StaticType.BOOL
 
     def _parse_precedence(self, precedence):
         self._advance()
-        prefix_rule = pratt.RULES.get(self.previous.type).prefix
+        prefix_rule = self.prefix_rules[self.previous.type]
         if prefix_rule is None:
             self._error("Expect expression.")
             return
 
         can_assign = precedence <= Precedence.ASSIGNMENT
-        prefix_rule(self, can_assign)
-        while precedence <= pratt.RULES.get(self.current.type).precedence:
+        self.expr_type = None
+        prefix_rule(can_assign)
+        precedences = pratt.PRECEDENCE
+        while precedence <= precedences[self.current.type]:
             self._advance()
-            infix_rule = pratt.RULES.get(self.previous.type).infix
-            infix_rule(self, can_assign)
+            self.infix_rules[self.previous.type](can_assign)
 
         if can_assign and self._match(TokenType.EQUAL):
             self._error("Invalid assignment target.")
@@ -376,28 +539,45 @@ class Compiler(Emitter):
             self.locals.initialize_current()
             return
 
-        self.emit_bytes(OP_DEFINE_GLOBAL, globvar)
+        self.emit_operand(OP_DEFINE_GLOBAL, globvar)
 
     def _declare_variable(self):
         if self.locals.scope_depth == 0:
             return
 
         name = self.previous
-        for localname, depth in self.locals:
-            if depth != -1 and depth < self.locals.scope_depth:
-                break
-
-            if name.length == localname.length and name.lexeme == localname.lexeme:
-                self._error("Already variable with this name in this scope.")
+        if self.locals.declared_in_scope(name.lexeme):
+            self._error("Already variable with this name in this scope.")
 
         self.locals.add(name, uninitialized=True)
+        self.local_ids.append(self.declared)
+        self.declared += 1
+
+    def _local_type(self, local_id):
+        if local_id in self.assumed:
+            return self.assumed[local_id]
+
+        # First pass: what was stored so far
+        return self.observed.get(local_id)
+
+    def _observe(self, local_id, static_type):
+        if local_id in self.observed:
+            static_type = join(self.observed[local_id], static_type)
+
+        self.observed[local_id] = static_type
+
+    def _specialized(self, opcode):
+        if self.profile is None or opcode == OP_GET_LOCAL:
+            return opcode
+
+        return self.profile.specialize(self.chunk.count, self.previous.line, opcode)
 
     def _identifier_constant(self, name):
-        return self._make_constant(types.LoxString(name.lexeme))
+        return self._make_constant(self.strings.intern(name.lexeme))
 
     def _end_compiler(self):
         self.emit_return()
-        if debug.PRINT_CODE and not errmac.errored:
+        if self.print_code and not self.errors.errored:
             debug.disassemble(self.chunk, "code")
 
     def _not_synchronizable(self):
@@ -408,7 +588,7 @@ class Compiler(Emitter):
         )
 
     def _synchronize(self):
-        errmac.panic_mode = False
+        self.errors.panic_mode = False
 
         while self._not_synchronizable():
             self._advance()
@@ -430,7 +610,7 @@ class Compiler(Emitter):
         return self.current.type is token_type
 
     def _error_at_current(self, message):
-        errmac.error_at(self.current, message)
+        self.errors.error_at(self.current, message)
 
     def _error(self, message):
-        errmac.error_at(self.previous, message)
+        self.errors.error_at(self.previous, message)
@@ -0,0 +1,308 @@
+import html
+import json
+import math
+import os
+from array import array
+
+from .dispatcher import WARMUP
+from .opcodes import OPCODES
+from .verifier import OPERAND_SIZES
+
+
+# Stands for the path of a script run without a file
+NO_FILE = "<script>"
+
+# From never run to hottest, for text listings
+HEAT = " .:-=+*#%@"
+
+# Generic instructions that have a specialized form, see typeprofile
+SPECIALIZABLE = {
+    "OP_ADD", "OP_SUBTRACT", "OP_MULTIPLY", "OP_DIVIDE", "OP_GREATER", "OP_LESS",
+    "OP_NEGATE", "OP_GET_GLOBAL",
+}
+
+
+def _decode(code):
+    # The name of the instruction at each offset, None for operand bytes
+    names = [None] * len(code)
+    offset = 0
+    while offset < len(code):
+        opcode = code[offset]
+        names[offset] = OPCODES[opcode]
+        offset += 1 + OPERAND_SIZES[opcode]
+
+    return names
+
+
+class FileCoverage:
+    """ Execution counts of one chunk, by offset, along with its line per offset.
+
+    `ops` names the instruction at each offset, None for operand bytes, as
+    of the last run: quickened instructions included. `pairs` counts the
+    instructions run right after the one before them in the code.
+    """
+    def __init__(self, lines, ops):
+        self.lines = array('i', lines)
+        self.counts = array('Q', bytes(8 * len(self.lines)))
+        self.ops = ops
+        self.pairs = {}
+
+    def merge(self, other):
+        for offset, count in enumerate(other.counts):
+            self.counts[offset] += count
+
+        for pair, count in other.pairs.items():
+            self.pairs[pair] = self.pairs.get(pair, 0) + count
+
+        self.ops = other.ops
+
+    def extend(self, cnk):
+        """ Make room for the code appended to `cnk` since, like the REPL's inputs """
+        recorded = len(self.lines)
+        self.lines.extend(cnk.lines[recorded:])
+        self.counts.frombytes(bytes(8 * (len(self.lines) - recorded)))
+        self.ops = self.ops + _decode(cnk.code)[recorded:]
+
+    def by_line(self):
+        """ line -> (times it ran, instructions run on it), for lines with code """
+        lines = {}
+        for offset, op in enumerate(self.ops):
+            if op is None:
+                continue
+
+            line = self.lines[offset]
+            runs, instructions = lines.get(line, (0, 0))
+            count = self.counts[offset]
+            lines[line] = (max(runs, count), instructions + count)
+
+        return lines
+
+
+class Coverage:
+    """ Execution counts of every chunk run, by file: scripts and modules.
+
+    A file is recorded afresh whenever it's run with other code than was
+    recorded, like another version of it: counts only add up for the same
+    code, across runs, VMs and saved coverage files. Code appended to what
+    was recorded, like the REPL's inputs, adds to the record.
+    """
+    def __init__(self):
+        # path -> FileCoverage
+        self.files = {}
+        # path -> chunk last run for it, to read the quickened instructions from
+        self.chunks = {}
+
+    def counts_for(self, path, cnk):
+        """ The FileCoverage to count the instructions of `cnk` into """
+        # Absolute, so that runs from other directories add up
+        path = os.path.abspath(path) if path else NO_FILE
+        record = self.files.get(path)
+        recorded = len(record.lines) if record is not None else 0
+        if record is None or record.lines.tolist() != cnk.lines[:recorded].tolist():
+            record = self.files[path] = FileCoverage(cnk.lines, _decode(cnk.code))
+        elif len(cnk.lines) > recorded:
+            record.extend(cnk)
+
+        self.chunks[path] = cnk
+        return record
+
+    def snapshot(self):
+        """ Note the instructions the chunks run so far ended up as """
+        for path, cnk in self.chunks.items():
+            record = self.files[path]
+            if len(cnk.code) == len(record.ops):
+                record.ops = _decode(cnk.code)
+
+    def merge(self, other):
+        other.snapshot()
+        for path, record in other.files.items():
+            mine = self.files.get(path)
+            if mine is None or mine.lines != record.lines:
+                self.files[path] = record
+            else:
+                mine.merge(record)
+
+    def save(self, path):
+        self.snapshot()
+        files = {
+            name: {
+                "lines": record.lines.tolist(),
+                "counts": record.counts.tolist(),
+                "ops": record.ops,
+                "pairs": [[*pair, count] for pair, count in record.pairs.items()],
+            }
+            for name, record in sorted(self.files.items())
+        }
+        with open(path, "w", encoding="utf8") as f:
+            json.dump({"files": files}, f)
+
+    @classmethod
+    def load(cls, path):
+        coverage = cls()
+        with open(path, encoding="utf8") as f:
+            files = json.load(f)["files"]
+
+        for name, saved in files.items():
+            record = FileCoverage(saved["lines"], saved["ops"])
+            record.counts = array('Q', saved["counts"])
+            record.pairs = {(first, second): count for first, second, count in saved["pairs"]}
+            coverage.files[name] = record
+
+        return coverage
+
+
+class CoverageInstructions:
+    """ Instructions counting every instruction `instructions` run into a Coverage """
+    def __init__(self, coverage, instructions):
+        self.coverage = coverage
+        self.instructions = instructions
+        self.chunk = None
+        self.record = None
+        # Offset right after the last instruction run, its name
+        self.next_site = -1
+        self.last = None
+
+    def dispatch(self, instr_name, vm):
+        # The REPL runs every input from the same chunk, grown each time
+        if vm.chunk is not self.chunk or len(vm.chunk.code) != len(self.record.counts):
+            self.chunk = vm.chunk
+            self.record = self.coverage.counts_for(vm.module_path, vm.chunk)
+            self.next_site = -1
+
+        record = self.record
+        site = vm.ip - 1
+        record.counts[site] += 1
+        if site == self.next_site:
+            pair = (self.last, instr_name)
+            record.pairs[pair] = record.pairs.get(pair, 0) + 1
+
+        self.last = instr_name
+        self.next_site = site + 1 + OPERAND_SIZES[vm.chunk.code[site]]
+        return self.instructions.dispatch(instr_name, vm)
+
+
+def _heat(runs, hottest):
+    # 0 for never run, then 1 to 9 on a log scale up to the hottest line
+    if not runs:
+        return 0
+
+    if hottest <= 1:
+        return len(HEAT) - 1
+
+    return 1 + round((len(HEAT) - 2) * math.log(runs) / math.log(hottest))
+
+
+def _listing(record, source):
+    # (line number, text, times run or None without code, instructions run, heat)
+    lines = record.by_line()
+    hottest = max((runs for runs, _ in lines.values()), default=0)
+    texts = source.splitlines() if source is not None else []
+    last = max(len(texts), max(lines, default=0))
+    for number in range(1, last + 1):
+        text = texts[number - 1] if number <= len(texts) else ""
+        runs, instructions = lines.get(number, (None, 0))
+        yield number, text, runs, instructions, _heat(runs, hottest)
+
+
+def render_text(coverage, sources=None):
+    """ Annotated listing of every file: times each line ran, instructions run on it, heat.
+
+    `sources` maps paths to their source text; lines of code that never
+    ran are flagged with #####.
+    """
+    sources = sources or {}
+    out = []
+    for path, record in sorted(coverage.files.items()):
+        out.append(f"== {path}")
+        for number, text, runs, instructions, heat in _listing(record, sources.get(path)):
+            if runs is None:
+                counts = ""
+            elif runs == 0:
+                counts = f"{'#####':>9}"
+            else:
+                counts = f"{runs:9} {instructions:10}"
+
+            out.append(f"{counts:20} {HEAT[heat]} {number:5} | {text}".rstrip())
+
+    return "\n".join(out)
+
+
+_STYLE = """
+body { font-family: monospace; }
+table { border-collapse: collapse; }
+td { padding: 0 0.5em; white-space: pre; }
+td.n { text-align: right; color: #888; }
+tr.miss td.src { background: #cce; }
+""" + "".join(
+    f"tr.h{level} td.src {{ background: hsl(0, 100%, {100 - 5 * level}%); }}\n"
+    for level in range(1, len(HEAT))
+)
+
+
+def render_html(coverage, sources=None, top=10):
+    """ The listing of `render_text` as a page, lines shaded from white to red as they get hotter """
+    sources = sources or {}
+    out = [f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><style>{_STYLE}</style></head><body>"]
+    for path, record in sorted(coverage.files.items()):
+        out.append(f"<h2>{html.escape(path)}</h2><table>")
+        out.append("<tr><th>runs</th><th>instructions</th><th>line</th><th></th></tr>")
+        for number, text, runs, instructions, heat in _listing(record, sources.get(path)):
+            if runs is None:
+                row, counts = "", "<td class=\"n\"></td><td class=\"n\"></td>"
+            elif runs == 0:
+                row, counts = " class=\"miss\"", "<td class=\"n\">#####</td><td class=\"n\"></td>"
+            else:
+                row, counts = f" class=\"h{heat}\"", f"<td class=\"n\">{runs}</td><td class=\"n\">{instructions}</td>"
+
+            out.append(f"<tr{row}>{counts}<td class=\"n\">{number}</td><td class=\"src\">{html.escape(text)}</td></tr>")
+
+        out.append("</table>")
+
+    out.append(f"<h2>Hints</h2><pre>{html.escape(hints(coverage, top))}</pre></body></html>")
+    return "\n".join(out)
+
+
+def hints(coverage, top=10):
+    """ Where superinstructions or specialization would pay off, hottest first.
+
+    Superinstructions: the pairs of instructions most often run one right
+    after the other. Specialization: the hottest instructions still generic
+    when the run ended although warm enough to quicken, or only specialized
+    while running. Only inference compiles the latter unchecked: a type
+    profile compiles the same guarded variants, and only in the script.
+    """
+    total = sum(sum(record.counts) for record in coverage.files.values()) or 1
+    pairs = {}
+    sites = []
+    for path, record in coverage.files.items():
+        for pair, count in record.pairs.items():
+            pairs[pair] = pairs.get(pair, 0) + count
+
+        for offset, op in enumerate(record.ops):
+            count = record.counts[offset]
+            if op is not None and count:
+                sites.append((count, path, offset, record.lines[offset], op))
+
+    out = ["Superinstruction candidates:"]
+    for (first, second), count in sorted(pairs.items(), key=lambda item: item[1], reverse=True)[:top]:
+        out.append(f"  {first} {second}: {count} times, {count / total:.1%} of instructions")
+
+    out.append("Specialization candidates:")
+    sites.sort(reverse=True)
+    candidates = 0
+    for count, path, offset, line, op in sites:
+        if candidates == top:
+            break
+
+        if op in SPECIALIZABLE and count > WARMUP:
+            advice = "still generic once warm: its operand types vary, or it deoptimized"
+        elif op.endswith(("_NUM", "_STR")):
+            advice = ("specialized while running: PLOXINFER=1 could compile it unchecked if it proves the types "
+                "(PLOXPROFILE only compiles the guarded form, in the script)")
+        else:
+            continue
+
+        out.append(f"  {path}:{line} {op} at {offset}: {count} times, {advice}")
+        candidates += 1
+
+    return "\n".join(out)
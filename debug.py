@@ -18,6 +18,15 @@ def constant_instruction(opname, chunk, offset):
     return offset + 2
 
 
+def long_instruction(opname, chunk, offset):
+    constant = chunk.code[offset + 1] << 8
+    constant |= chunk.code[offset + 2]
+    print(f"{opname:16} {constant:4} ", end="")
+    value.print_value(chunk.constants.values[constant])
+    print()
+    return offset + 3
+
+
 def byte_instruction(opname, chunk, offset):
     slot = chunk.code[offset + 1]
     print(f"{opname:16} {slot:4} ")
@@ -45,6 +54,8 @@ def disasm_instruction(chunk, offset):
         return constant_instruction(opname, chunk, offset)
     elif opname in OPCODES_BYTEINSTR:
         return byte_instruction(opname, chunk, offset)
+    elif opname in OPCODES_LONG:
+        return long_instruction(opname, chunk, offset)
     elif opname in OPCODES_JUMPINSTR:
         return jump_instruction(opname, -1 if inst == OP_LOOP else 1, chunk, offset)
     else:
@@ -1,24 +1,71 @@
 from operator import add, sub, mul, truediv, gt, lt
 
 from .enums import VMResult
-from . import types, value
+from .exceptions import LoxMemoryError, LoxRuntimeError
+from .opcodes import *
+from . import memory, program, types, value
 
 
-def _binary_op(vm, opfunc):
+# Executions with the same operand types before an instruction is specialized
+WARMUP = 8
+# After a guard failed, how much longer the instruction waits before trying again
+BACKOFF = 64
+
+
+def _binary_op(vm, opfunc, specialized=None):
     b = vm.stack.peek()
     a = vm.stack.peek(1)
-    both_float = isinstance(a, float) and isinstance(b, float)
-    both_string = isinstance(a, types.LoxString) and isinstance(b, types.LoxString)
-
-    if not any([both_float, both_string]):
+    both_float = type(a) is float and type(b) is float
+    if not both_float and not (isinstance(a, types.LoxString) and isinstance(b, types.LoxString)):
         vm.runtime_error("Operands must be two numbers or two strings.")
         return VMResult.RUNTIME_ERROR
 
+    if both_float and specialized is not None:
+        _warm_up(vm, vm.ip - 1, specialized)
+
     b = vm.stack.pop()
     a = vm.stack.pop()
     vm.stack.push(opfunc(a, b))
 
 
+def _warm_up(vm, site, specialized):
+    """ Count an execution of `site`, and specialize it once it's warm.
+
+    Returns whether the instruction got rewritten.
+    """
+    counters = vm.chunk.counters
+    count = counters[site] + 1
+    if count < WARMUP:
+        counters[site] = count
+        return False
+
+    counters[site] = 0
+    vm.chunk.code[site] = specialized
+    return True
+
+
+def _deoptimize(vm, site, generic):
+    # Back to the generic instruction, which will take longer to try again
+    vm.chunk.code[site] = generic
+    vm.chunk.counters[site] = -BACKOFF
+    vm.chunk.caches.pop(site, None)
+
+
+def _num_op(vm, opfunc, generic):
+    """ Fast path for specialized numeric instructions, deoptimizing on a miss """
+    stack = vm.stack.stack
+    b = stack[-1]
+    a = stack[-2]
+    if type(a) is float and type(b) is float:
+        stack.pop()
+        stack[-1] = opfunc(a, b)
+        vm.stack.stack_top -= 1
+        return False
+
+    _deoptimize(vm, vm.ip - 1, generic)
+    return True
+
+
 def _is_falsey(value):
     return value is None or not bool(value)
 
@@ -27,27 +74,95 @@ def _equality(a, b):
     if type(a) is not type(b):
         return False
 
-    if a is True or a is False:
-        return a is b
+    if isinstance(a, float):
+        return a == b
 
-    if a is None:
-        return True
+    if isinstance(a, types.LoxString) and not (a.interned and b.interned):
+        # Concatenation results aren't interned, compare the contents
+        return a == b
 
-    return a == b
+    # nil, booleans and interned strings are all unique objects
+    return a is b
 
 
 class Arithmetics:
     def OP_ADD(self, vm):
-        return _binary_op(vm, add)
+        b = vm.stack.peek()
+        a = vm.stack.peek(1)
+        if isinstance(a, types.LoxString) and isinstance(b, types.LoxString):
+            _warm_up(vm, vm.ip - 1, OP_ADD_STR)
+            b = vm.stack.pop()
+            a = vm.stack.pop()
+            vm.stack.push(vm.strings.concat(a, b))
+        else:
+            return _binary_op(vm, add, OP_ADD_NUM)
 
     def OP_SUBTRACT(self, vm):
-        return _binary_op(vm, sub)
+        return _binary_op(vm, sub, OP_SUBTRACT_NUM)
 
     def OP_MULTIPLY(self, vm):
-        return _binary_op(vm, mul)
-        
+        return _binary_op(vm, mul, OP_MULTIPLY_NUM)
+
     def OP_DIVIDE(self, vm):
-        return _binary_op(vm, truediv)
+        return _binary_op(vm, truediv, OP_DIVIDE_NUM)
+
+    def OP_ADD_NUM(self, vm):
+        if _num_op(vm, add, OP_ADD):
+            return self.OP_ADD(vm)
+
+    def OP_ADD_STR(self, vm):
+        stack = vm.stack.stack
+        b = stack[-1]
+        a = stack[-2]
+        if type(a) is types.LoxString and type(b) is types.LoxString:
+            stack.pop()
+            stack[-1] = vm.strings.concat(a, b)
+            vm.stack.stack_top -= 1
+        else:
+            _deoptimize(vm, vm.ip - 1, OP_ADD)
+            return self.OP_ADD(vm)
+
+    def OP_SUBTRACT_NUM(self, vm):
+        if _num_op(vm, sub, OP_SUBTRACT):
+            return self.OP_SUBTRACT(vm)
+
+    def OP_MULTIPLY_NUM(self, vm):
+        if _num_op(vm, mul, OP_MULTIPLY):
+            return self.OP_MULTIPLY(vm)
+
+    def OP_DIVIDE_NUM(self, vm):
+        if _num_op(vm, truediv, OP_DIVIDE):
+            return self.OP_DIVIDE(vm)
+
+    def OP_ADD_NUM_UNCHECKED(self, vm):
+        stack = vm.stack.stack
+        b = stack.pop()
+        stack[-1] = stack[-1] + b
+        vm.stack.stack_top -= 1
+
+    def OP_ADD_STR_UNCHECKED(self, vm):
+        stack = vm.stack.stack
+        b = stack.pop()
+        stack[-1] = vm.strings.concat(stack[-1], b)
+        vm.stack.stack_top -= 1
+
+    def OP_SUBTRACT_UNCHECKED(self, vm):
+        stack = vm.stack.stack
+        b = stack.pop()
+        stack[-1] = stack[-1] - b
+        vm.stack.stack_top -= 1
+
+    def OP_MULTIPLY_UNCHECKED(self, vm):
+        stack = vm.stack.stack
+        b = stack.pop()
+        stack[-1] = stack[-1] * b
+        vm.stack.stack_top -= 1
+
+    def OP_DIVIDE_UNCHECKED(self, vm):
+        stack = vm.stack.stack
+        b = stack.pop()
+        stack[-1] = stack[-1] / b
+        vm.stack.stack_top -= 1
 
 
 class Comparisons:
@@ -57,10 +172,30 @@ class Comparisons:
         vm.stack.push(_equality(a, b))
 
     def OP_GREATER(self, vm):
-        return _binary_op(vm, gt)
+        return _binary_op(vm, gt, OP_GREATER_NUM)
 
     def OP_LESS(self, vm):
-        return _binary_op(vm, lt)
+        return _binary_op(vm, lt, OP_LESS_NUM)
+
+    def OP_GREATER_NUM(self, vm):
+        if _num_op(vm, gt, OP_GREATER):
+            return self.OP_GREATER(vm)
+
+    def OP_LESS_NUM(self, vm):
+        if _num_op(vm, lt, OP_LESS):
+            return self.OP_LESS(vm)
+
+    def OP_GREATER_UNCHECKED(self, vm):
+        stack = vm.stack.stack
+        b = stack.pop()
+        stack[-1] = stack[-1] > b
+        vm.stack.stack_top -= 1
+
+    def OP_LESS_UNCHECKED(self, vm):
+        stack = vm.stack.stack
+        b = stack.pop()
+        stack[-1] = stack[-1] < b
+        vm.stack.stack_top -= 1
 
 
 class Singletons:
@@ -99,6 +234,16 @@ class Instructions(Arithmetics, Singletons, Comparisons):
         constant = vm.chunk.constants.values[addr]
         vm.stack.push(constant)
 
+    def OP_CONSTANT_LONG(self, vm):
+        vm.stack.push(vm.chunk.constants.values[vm.next_short()])
+
+    def OP_IMPORT(self, vm):
+        addr = vm.next_instruction()
+        return vm.import_module(str(vm.chunk.constants.values[addr]))
+
+    def OP_IMPORT_LONG(self, vm):
+        return vm.import_module(str(vm.chunk.constants.values[vm.next_short()]))
+
     def OP_PRINT(self, vm):
         val = vm.stack.pop()
         value.print_value(val, end="\n")
@@ -110,6 +255,9 @@ class Instructions(Arithmetics, Singletons, Comparisons):
 
         vm.stack.stack[-1] *= -1
 
+    def OP_NEGATE_UNCHECKED(self, vm):
+        vm.stack.stack[-1] *= -1
+
     def OP_NOT(self, vm):
         val = vm.stack.stack[-1]
         vm.stack.stack[-1] = _is_falsey(val)
@@ -129,28 +277,139 @@ class Instructions(Arithmetics, Singletons, Comparisons):
     def OP_GET_GLOBAL(self, vm):
         addr = vm.next_instruction()
         name = vm.chunk.constants.values[addr]
-        value = vm.globals.get(name.hash, byhash=True)
+        value = vm.globals.get(name)
 
-        if value is None:
+        # nil is a value too, only then is the extra lookup worth it
+        if value is None and not vm.globals.contains(name):
             vm.runtime_error(f"Undefined variable '{name}'")
             return VMResult.RUNTIME_ERROR
 
+        site = vm.ip - 2
+        if _warm_up(vm, site, OP_GET_GLOBAL_CACHED):
+            vm.chunk.caches[site] = (vm.globals.version, vm.globals.slot(name))
+
         vm.stack.push(value)
 
+    def OP_GET_GLOBAL_CACHED(self, vm):
+        # Valid as long as no global was defined or removed since
+        site = vm.ip - 1
+        cache = vm.chunk.caches.get(site)
+        if cache is not None and cache[0] == vm.globals.version:
+            vm.ip += 1
+            vm.stack.push(vm.globals.value_at(cache[1]))
+            return
+
+        if cache is None:
+            # Emitted by the compiler from a type profile, resolve it once
+            name = vm.chunk.constants.values[vm.chunk.code[vm.ip]]
+            slot = vm.globals.slot(name)
+            if slot is not None:
+                vm.chunk.caches[site] = (vm.globals.version, slot)
+                return self.OP_GET_GLOBAL_CACHED(vm)
+
+        _deoptimize(vm, site, OP_GET_GLOBAL)
+        return self.OP_GET_GLOBAL(vm)
+
+    def OP_GET_GLOBAL_LONG(self, vm):
+        # Never quickened: the cached variant only has room for a byte operand
+        name = vm.chunk.constants.values[vm.next_short()]
+        value = vm.globals.get(name)
+        if value is None and not vm.globals.contains(name):
+            vm.runtime_error(f"Undefined variable '{name}'")
+            return VMResult.RUNTIME_ERROR
+
+        vm.stack.push(value)
+
+    def OP_CALL(self, vm):
+        arg_count = vm.next_instruction()
+        callee = vm.stack.peek(arg_count)
+        if not isinstance(callee, types.LoxNative):
+            vm.runtime_error("Can only call functions and classes.")
+            return VMResult.RUNTIME_ERROR
+
+        if callee.arity is not None and arg_count != callee.arity:
+            vm.runtime_error(f"Expected {callee.arity} arguments but got {arg_count}.")
+            return VMResult.RUNTIME_ERROR
+
+        stack = vm.stack.stack
+        args = stack[len(stack) - arg_count:]
+        try:
+            # Natives defined from Python may return Python values
+            result = program.to_lox(callee.function(*args), vm.memory)
+        except LoxRuntimeError as e:
+            vm.runtime_error(str(e))
+            return VMResult.RUNTIME_ERROR
+        except LoxMemoryError:
+            raise
+        except Exception as e:
+            vm.runtime_error(f"Error in native {callee.name}(): {type(e).__name__}: {e}")
+            return VMResult.RUNTIME_ERROR
+
+        # The arguments and the callee itself
+        del stack[len(stack) - arg_count - 1:]
+        vm.stack.stack_top -= arg_count + 1
+        vm.stack.push(result)
+
+    def OP_GET_INDEX(self, vm):
+        container = vm.stack.peek(1)
+        if not isinstance(container, (types.LoxMap, types.LoxArray)):
+            vm.runtime_error("Only maps and arrays can be indexed.")
+            return VMResult.RUNTIME_ERROR
+
+        try:
+            value = container.get(vm.stack.peek())
+        except LoxRuntimeError as e:
+            vm.runtime_error(str(e))
+            return VMResult.RUNTIME_ERROR
+
+        vm.stack.pop()
+        vm.stack.stack[-1] = value
+
+    def OP_SET_INDEX(self, vm):
+        container = vm.stack.peek(2)
+        if not isinstance(container, (types.LoxMap, types.LoxArray)):
+            vm.runtime_error("Only maps and arrays can be indexed.")
+            return VMResult.RUNTIME_ERROR
+
+        value = vm.stack.peek()
+        try:
+            container.set(vm.stack.peek(1), value)
+        except LoxRuntimeError as e:
+            vm.runtime_error(str(e))
+            return VMResult.RUNTIME_ERROR
+
+        # Maps grow as they're filled
+        vm.memory.adopt(container)
+
+        # The assignment evaluates to the value, in place of the container
+        del vm.stack.stack[-2:]
+        vm.stack.stack_top -= 2
+        vm.stack.stack[-1] = value
+
     def OP_DEFINE_GLOBAL(self, vm):
         addr = vm.next_instruction()
         name = vm.chunk.constants.values[addr]
-        #vm.globals.insert(name.buffer, vm.stack.peek())
-        #vm.stack.pop()
-        # Is this code the same?
-        vm.globals.insert(name.buffer, vm.stack.pop())
+        if not vm.globals.insert(name, vm.stack.pop()):
+            vm.memory.charge(memory.GLOBAL_SIZE)
+
+    def OP_DEFINE_GLOBAL_LONG(self, vm):
+        name = vm.chunk.constants.values[vm.next_short()]
+        if not vm.globals.insert(name, vm.stack.pop()):
+            vm.memory.charge(memory.GLOBAL_SIZE)
 
     def OP_SET_GLOBAL(self, vm):
         addr = vm.next_instruction()
         name = vm.chunk.constants.values[addr]
 
-        defined = vm.globals.insert(name.hash, vm.stack.peek(), byhash=True)
+        defined = vm.globals.insert(name, vm.stack.peek())
         if not defined:
-            vm.globals.remove(name.hash, byhash=True)
+            vm.globals.remove(name)
+            vm.runtime_error(f"Undefined variable '{name}'")
+            return VMResult.RUNTIME_ERROR
+
+    def OP_SET_GLOBAL_LONG(self, vm):
+        name = vm.chunk.constants.values[vm.next_short()]
+        if not vm.globals.insert(name, vm.stack.peek()):
+            vm.globals.remove(name)
             vm.runtime_error(f"Undefined variable '{name}'")
             return VMResult.RUNTIME_ERROR
@@ -6,3 +6,10 @@ class VMResult(Enum):
     COMPILE_ERROR = auto()
     RUNTIME_ERROR = auto()
 
+
+class StaticType(Enum):
+    NUMBER = auto()
+    STRING = auto()
+    BOOL = auto()
+    NIL = auto()
+
@@ -8,36 +8,41 @@ def stderr(message, *args, **kwargs):
 
 
 class ErrorMachinery:
-    __instance = None
+    """ Error state of one VM and its compilers.
 
+    Messages are printed to stderr unless `echo` is off, and kept in
+    `messages` until the next reset either way.
+    """
     def __init__(self):
+        self.echo = True
         self.reset()
 
-    def __new__(cls):
-        if ErrorMachinery.__instance is None:
-            ErrorMachinery.__instance = object.__new__(cls)
-
-        return ErrorMachinery.__instance
-
     def error_at(self, token, message):
         if self.panic_mode:
             return
 
         self.panic_mode = True
-        stderr(f"[line {token.line}] Error", end="")
         if token.type is TokenType.EOF:
-            stderr(" at end", end="")
+            where = " at end"
         elif token.type is not TokenType.ERROR:
-            stderr(f" at {token.lexeme}", end="")
+            where = f" at {token.lexeme}"
+        else:
+            where = ""
 
-        stderr(f": {message}")
+        self._report(f"[line {token.line}] Error{where}: {message}")
         self.errored = True
 
     def runtime_error(self, message):
-        stderr(message)
+        self._report(message)
         self.runtime_errored = True
 
+    def _report(self, message):
+        self.messages.append(message)
+        if self.echo:
+            stderr(message)
+
     def reset(self):
+        self.messages = []
         self.errored = False
         self.runtime_errored = False
         self.panic_mode = False
\ No newline at end of file
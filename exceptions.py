@@ -7,3 +7,19 @@ class LoxStackOverflow(LoxException):
 
 class LoxTooManyLocals(LoxException):
     pass
+
+class LoxRuntimeError(LoxException):
+    """ Raised by natives, reported as a runtime error of the script """
+    pass
+
+class LoxMemoryError(LoxException):
+    """ Raised when a VM goes over its memory quota """
+    pass
+
+class LoxCompileError(LoxException):
+    """ Raised by the embedding API when a script doesn't compile """
+    pass
+
+class LoxVerifyError(LoxException):
+    """ Raised when bytecode isn't safe to run, see verifier.verify """
+    pass
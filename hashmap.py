@@ -1,3 +1,17 @@
+import os
+import warnings
+import zlib
+from array import array
+from functools import partial
+from hashlib import blake2b
+
+
+EMPTY = -1
+# 2**32 divided by the golden ratio
+FIBONACCI = 2654435769
+# Entries migrated by each operation while rehashing incrementally
+REHASH_STEP = 4
+
 
 def fnv1a(b):
     h = 2166136261
@@ -7,19 +21,121 @@ def fnv1a(b):
     return h & 0xFFFFFFFF
 
 
+def keyed_blake2b(key):
+    def blake2b32(b):
+        return int.from_bytes(blake2b(b, digest_size=4, key=key).digest(), "little")
+
+    return blake2b32
+
+
+# fnv1a is the reference, but a per-byte loop in Python costs O(len) bytecodes
+# for every string. CRC32 runs in C, and it's just as 32-bit and deterministic.
+hash_bytes = zlib.crc32
+
+
+def set_hash_seed(seed):
+    """ Seed the hashing of every key in the process, or unseed it with 0/None.
+
+    CRC32 collisions are trivial to craft, so tables fed with untrusted keys
+    should be seeded: keys are then hashed with BLAKE2b, keyed by the seed.
+    It has to happen before anything is hashed, since LoxStrings cache their
+    hash and tables never rehash their keys.
+    """
+    global hash_bytes
+    if not seed:
+        hash_bytes = zlib.crc32
+    else:
+        if isinstance(seed, int):
+            seed = seed.to_bytes(16, "little")
+
+        hash_bytes = keyed_blake2b(seed)
+
+
+def seed_from_environment():
+    # Same convention as PYTHONHASHSEED, but off unless asked for
+    seed = os.environ.get("PLOXHASHSEED", "0")
+    if seed == "random":
+        return os.urandom(16)
+
+    try:
+        seed = int(seed)
+    except ValueError:
+        seed = -1
+
+    if not 0 <= seed < 2**128:
+        warnings.warn("PLOXHASHSEED must be \"random\" or an integer in [0, 2**128), hashing unseeded",
+            RuntimeWarning)
+        return 0
+
+    return seed
+
+
+def hash_key(key):
+    # LoxStrings know (and cache) their own hash
+    hsh = getattr(key, "hash", None)
+    if hsh is None:
+        return hash_bytes(key)
+
+    return hsh
+
+
+def index_typecode(capacity):
+    # Like CPython's dicts, the indices are only as wide as the capacity needs
+    if capacity <= 2**7:
+        return 'b'
+    elif capacity <= 2**15:
+        return 'h'
+    elif capacity <= 2**31:
+        return 'i'
+    else:
+        return 'q'
+
+
+def make_indices(capacity):
+    return array(index_typecode(capacity), [EMPTY]) * capacity
+
+
+def scramble(hsh):
+    # Fibonacci hashing: the top bits of the product depend on every bit of
+    # the hash, so hashes that only differ in their high bits don't pile up
+    # on the same slots. It's a bijection on 32 bits, equality is preserved.
+    return (hsh * FIBONACCI) & 0xFFFFFFFF
+
+
 class HashMap:
-    """ Hash table using open addressing insertion technique """
-    def __init__(self, initializer=None, *, chunksize=16, loadfactor=0.75, growfactor=2, maxsize=2**19):
+    """ Compact hash table using open addressing with Robin Hood probing.
+
+    `indices` maps slots to positions in the dense, parallel entry arrays
+    (`hashes`, `keys`, `values`). Keys are bytes, or objects with a `hash`
+    attribute; on a hash match, keys are compared by identity, then equality.
+    An entry's home slot is given by the top bits of its scrambled hash.
+    Entries are kept sorted by their distance from their home slot, which
+    bounds the probe lengths; removals shift the following entries back
+    instead of leaving tombstones around.
+
+    With `incremental`, resizing doesn't rebuild the indices in one go: the
+    old table is kept next to the new one and every operation migrates a few
+    of its entries, so that no single operation pays for the whole rehash.
+    """
+    def __init__(self, initializer=None, *, chunksize=16, loadfactor=0.75, growfactor=2,
+            incremental=False):
         self.chunksize = chunksize
         self.loadfactor = loadfactor
         self.growfactor = growfactor
-        self.maxsize = maxsize
+        self.incremental = incremental
         self.capacity = chunksize
-        self.indices = [None] * chunksize
+        self.shift = 33 - chunksize.bit_length()
+        self.threshold = int(chunksize * loadfactor)
+        self.indices = make_indices(chunksize)
+        # While rehashing incrementally, the table being drained and how far we got
+        self.old_indices = None
+        self.rehash_pos = 0
         # These are parallel arrays
         self.hashes = []
         self.keys = []
         self.values = []
+        # Bumped whenever entries come or go, which invalidates slots
+        self.version = 0
         if initializer:
             self.insert_all(initializer)
 
@@ -27,37 +143,64 @@ class HashMap:
         if isinstance(key, str):
             key = bytes(key, "ascii")
 
-        if not byhash:
-            hsh = fnv1a(key)
-        else:
-            hsh = key
-
-        idx = hsh & (self.capacity - 1)
-        inserted = False
-        substituted = False
-        while not inserted:
-            cidx = self.indices[idx]
-            # We can insert either if it's not present or if it's a tombstone
-            if cidx is None or cidx is False:
-                inserted = True
-                self.indices[idx] = len(self.hashes)
-                self.hashes.append(hsh)
-                self.values.append(value)
-                self.keys.append(key)
-            else:
-                if self.hashes[cidx] == hsh:
-                    inserted = True
-                    substituted = True
+        hsh = ((key if byhash else hash_key(key)) * FIBONACCI) & 0xFFFFFFFF
+        if self.old_indices is not None:
+            self._rehash_step()
+
+        if self.old_indices is not None:
+            oidx = self._probe(self.old_indices, hsh, key)
+            if oidx != EMPTY:
+                self.values[self.old_indices[oidx]] = value
+                return True
+
+        indices = self.indices
+        hashes = self.hashes
+        mask = self.capacity - 1
+        shift = self.shift
+        idx = hsh >> shift
+        dist = 0
+        while True:
+            cidx = indices[idx]
+            if cidx == EMPTY:
+                break
+
+            chash = hashes[cidx]
+            if chash == hsh:
+                ckey = self.keys[cidx]
+                if ckey is key or ckey == key:
                     self.values[cidx] = value
-                else:
-                    idx += 1
-                    if idx == self.capacity:
-                        idx = 0
+                    return True
+
+            # A richer entry than us: had the key been there, we would have met it already
+            if (idx - (chash >> shift)) & mask < dist:
+                break
+
+            idx = (idx + 1) & mask
+            dist += 1
 
-        if self.overloaded:
-            self._allocate_next()
+        entry = len(hashes)
+        hashes.append(hsh)
+        self.keys.append(key)
+        self.values.append(value)
+        self.version += 1
+        # Take the slot, and push the displaced entries forward
+        while cidx != EMPTY:
+            cdist = (idx - (hashes[cidx] >> shift)) & mask
+            if cdist < dist:
+                indices[idx] = entry
+                entry = cidx
+                dist = cdist
 
-        return substituted
+            idx = (idx + 1) & mask
+            dist += 1
+            cidx = indices[idx]
+
+        indices[idx] = entry
+
+        if len(hashes) > self.threshold:
+            self._resize(self.capacity * self.growfactor)
+
+        return False
 
     def insert_all(self, it):
         if isinstance(it, dict):
@@ -70,73 +213,82 @@ class HashMap:
         if isinstance(key, str):
             key = bytes(key, "ascii")
 
-        if not byhash:
-            hsh = fnv1a(key)
-        else:
-            hsh = key
+        hsh = ((key if byhash else hash_key(key)) * FIBONACCI) & 0xFFFFFFFF
+        if self.old_indices is not None:
+            self._rehash_step()
+            indices, idx = self._find(hsh, key)
+            if idx != EMPTY:
+                return self.values[indices[idx]]
+
+            return
+
+        # Same probing as _probe, inlined: lookups are the hottest path
+        shift = self.shift
+        idx = hsh >> shift
+        cidx = self.indices[idx]
+        if cidx == EMPTY:
+            return
+
+        hashes = self.hashes
+        keys = self.keys
+        if hashes[cidx] == hsh:
+            ckey = keys[cidx]
+            # Most keys sit right in their home slot
+            if ckey is key or ckey == key:
+                return self.values[cidx]
 
-        idx = hsh & (self.capacity - 1)
+        indices = self.indices
+        mask = self.capacity - 1
+        idx = (idx + 1) & mask
+        dist = 1
         while True:
-            cidx = self.indices[idx]
-            if cidx is None:
-                # Not present
+            cidx = indices[idx]
+            if cidx == EMPTY:
                 return
 
-            if self.hashes[cidx] == hsh:
-                return self.values[cidx]
+            chash = hashes[cidx]
+            if chash == hsh:
+                ckey = keys[cidx]
+                if ckey is key or ckey == key:
+                    return self.values[cidx]
+
+            if (idx - (chash >> shift)) & mask < dist:
+                return
 
-            idx += 1
-            if idx == self.capacity:
-                idx = 0
+            idx = (idx + 1) & mask
+            dist += 1
 
     def remove(self, key, *, byhash=False):
         if isinstance(key, str):
             key = bytes(key, "ascii")
 
-        if not byhash:
-            hsh = fnv1a(key)
-        else:
-            hsh = key
-
-        idx = hsh & (self.capacity - 1)
-        removed = False
-        while not removed:
-            cidx = self.indices[idx]
-            if cidx is None:
-                # Not present
-                return
+        if self.old_indices is not None:
+            self._rehash_step()
 
-            if self.hashes[cidx] == hsh:
-                # Make a tombstone
-                self.indices[idx] = False
-                # In case we're removing the only one or the last
-                # element, just pop the values
-                if (cidx == 0 and self.count == 1) or cidx == self.count - 1:
-                    self.hashes.pop()
-                    self.values.pop()
-                    self.keys.pop()
-                    break
+        indices, idx = self._find(scramble(key if byhash else hash_key(key)), key)
+        if idx == EMPTY:
+            # Not present
+            return
 
-                # Otherwise, fill the gap
-                lasthash = self.hashes[-1]
-                lastidx = lasthash & (self.capacity - 1)
-                # Resolve collisions once again
-                while not removed:
-                    lastcidx = self.indices[lastidx]
-                    if self.hashes[lastcidx] == lasthash:
-                        self.indices[lastidx] = cidx
-                        self.hashes[cidx] = self.hashes.pop()
-                        self.values[cidx] = self.values.pop()
-                        self.keys[cidx] = self.keys.pop()
-                        removed = True
-                    else:
-                        lastcidx += 1
-                        if lastcidx == self.capacity:
-                            lastcidx = 0
-            else:
-                idx += 1
-                if idx == self.capacity:
-                    idx = 0
+        cidx = indices[idx]
+        self._shift_back(indices, idx)
+
+        # Keep the entries dense: move the last one in the gap
+        last = len(self.hashes) - 1
+        if cidx != last:
+            indices, idx = self._slot_of(last)
+            indices[idx] = cidx
+            self.hashes[cidx] = self.hashes[last]
+            self.keys[cidx] = self.keys[last]
+            self.values[cidx] = self.values[last]
+
+        self.hashes.pop()
+        self.keys.pop()
+        self.values.pop()
+        self.version += 1
+
+        if len(self.hashes) < self.threshold // 4 and self.capacity > self.chunksize:
+            self._resize(self.capacity // self.growfactor)
 
     @property
     def overloaded(self):
@@ -150,106 +302,292 @@ class HashMap:
     def count(self):
         return len(self.hashes)
 
-    def _allocate_next(self):
-        if self.chunksize < self.maxsize:
-            self.chunksize *= self.growfactor
-            self.capacity = self.chunksize
-        else:
-            self.capacity *= self.growfactor
+    @property
+    def rehashing(self):
+        return self.old_indices is not None
+
+    def _find(self, hsh, key):
+        """ Look for `key` in the current table, then in the one being drained """
+        idx = self._probe(self.indices, hsh, key)
+        if idx == EMPTY and self.old_indices is not None:
+            return self.old_indices, self._probe(self.old_indices, hsh, key)
+
+        return self.indices, idx
+
+    def _probe(self, indices, hsh, key):
+        hashes = self.hashes
+        keys = self.keys
+        mask = len(indices) - 1
+        shift = 33 - len(indices).bit_length()
+        idx = hsh >> shift
+        dist = 0
+        while True:
+            cidx = indices[idx]
+            if cidx == EMPTY:
+                return EMPTY
 
-        mask = self.capacity - 1
-        self.indices = [None] * self.capacity
-        for cidx, h in enumerate(self.hashes):
-            idx = h & mask
+            chash = hashes[cidx]
+            if chash == hsh:
+                ckey = keys[cidx]
+                if ckey is key or ckey == key:
+                    return idx
+
+            if (idx - (chash >> shift)) & mask < dist:
+                return EMPTY
+
+            idx = (idx + 1) & mask
+            dist += 1
 
+    def _slot_of(self, entry):
+        for indices in (self.indices, self.old_indices):
+            if indices is None:
+                continue
+
+            mask = len(indices) - 1
+            idx = self.hashes[entry] >> (33 - len(indices).bit_length())
             while True:
-                if self.indices[idx] is None:
-                    self.indices[idx] = cidx
+                cidx = indices[idx]
+                if cidx == entry:
+                    return indices, idx
+
+                if cidx == EMPTY:
                     break
 
-                idx += 1
-                if idx == self.capacity:
-                    idx = 0
+                idx = (idx + 1) & mask
+
+    def _place(self, indices, entry, idx, dist):
+        """ Put `entry` in slot `idx`, pushing the richer entries forward """
+        hashes = self.hashes
+        mask = len(indices) - 1
+        shift = 33 - len(indices).bit_length()
+        while True:
+            cidx = indices[idx]
+            if cidx == EMPTY:
+                indices[idx] = entry
+                return
+
+            cdist = (idx - (hashes[cidx] >> shift)) & mask
+            if cdist < dist:
+                indices[idx] = entry
+                entry = cidx
+                dist = cdist
+
+            idx = (idx + 1) & mask
+            dist += 1
+
+    def _shift_back(self, indices, idx):
+        """ Empty slot `idx`, moving back the entries displaced after it """
+        hashes = self.hashes
+        mask = len(indices) - 1
+        shift = 33 - len(indices).bit_length()
+        nxt = (idx + 1) & mask
+        while True:
+            cidx = indices[nxt]
+            if cidx == EMPTY or hashes[cidx] >> shift == nxt:
+                break
+
+            indices[idx] = cidx
+            idx = nxt
+            nxt = (nxt + 1) & mask
+
+        indices[idx] = EMPTY
+
+    def _resize(self, capacity):
+        if self.old_indices is not None:
+            # Resizing again before being done: no choice but finishing now
+            while self.old_indices is not None:
+                self._rehash_step(self.count + 1)
+
+        old_indices = self.indices
+        self.capacity = capacity
+        self.shift = 33 - capacity.bit_length()
+        self.threshold = int(capacity * self.loadfactor)
+        if self.incremental:
+            self.indices = make_indices(capacity)
+            self.old_indices = old_indices
+            self.rehash_pos = 0
+        else:
+            self._rebuild()
+
+    def _rehash_step(self, steps=REHASH_STEP):
+        """ Move up to `steps` entries out of the old table, in slot order.
+
+        Removing them from the old table with a backward shift keeps it a
+        valid Robin Hood table, so lookups can keep probing it meanwhile.
+        The slots before `rehash_pos` are all empty by then.
+        """
+        old = self.old_indices
+        new = self.indices
+        hashes = self.hashes
+        shift = self.shift
+        pos = self.rehash_pos
+        top = len(old)
+        # Bound the empty slots we walk over too, as Redis does
+        empty_visits = steps * 10
+        while pos < top:
+            cidx = old[pos]
+            if cidx == EMPTY:
+                pos += 1
+                empty_visits -= 1
+                if empty_visits == 0:
+                    break
+
+                continue
+
+            if steps == 0:
+                break
+
+            self._shift_back(old, pos)
+            self._place(new, cidx, hashes[cidx] >> shift, 0)
+            steps -= 1
+
+        self.rehash_pos = pos
+        if pos == top:
+            self.old_indices = None
+
+    def _rebuild(self):
+        shift = self.shift
+        self.indices = indices = make_indices(self.capacity)
+        for entry, hsh in enumerate(self.hashes):
+            idx = hsh >> shift
+            if indices[idx] == EMPTY:
+                indices[idx] = entry
+            else:
+                self._place(indices, entry, idx, 0)
+
+    def contains(self, key, *, byhash=False):
+        if isinstance(key, str):
+            key = bytes(key, "ascii")
+
+        hsh = scramble(key if byhash else hash_key(key))
+        if self.old_indices is not None:
+            self._rehash_step()
+
+        return self._find(hsh, key)[1] != EMPTY
+
+    def slot(self, key):
+        """ Where the value of `key` lives, until `version` changes """
+        if isinstance(key, str):
+            key = bytes(key, "ascii")
+
+        indices, idx = self._find(scramble(hash_key(key)), key)
+        if idx == EMPTY:
+            return
+
+        return indices[idx]
+
+    def value_at(self, slot):
+        return self.values[slot]
+
+    def items(self):
+        return zip(self.keys, self.values)
 
     def __contains__(self, key):
-        return self.get(key) is not None
+        return self.contains(key)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __len__(self):
+        return len(self.hashes)
 
 
 class HashSet(HashMap):
     def insert(self, value, *, byhash=False):
-        if isinstance(value, str):
-            value = bytes(value, "ascii")
+        return super().insert(value, value, byhash=byhash)
 
-        if not byhash:
-            hsh = fnv1a(value)
-        else:
-            hsh = value
-
-        idx = hsh & (self.capacity - 1)
-        inserted = False
-        while not inserted:
-            cidx = self.indices[idx]
-            # We can insert either if it's not present or if it's a tombstone
-            if cidx is None or cidx is False:
-                inserted = True
-                self.indices[idx] = len(self.hashes)
-                self.hashes.append(hsh)
-                self.values.append(value)
-            else:
-                if self.hashes[cidx] == hsh:
-                    inserted = True
-                    self.values[cidx] = value
-                else:
-                    idx += 1
-                    if idx == self.capacity:
-                        idx = 0
+    def insert_all(self, it):
+        for value in it:
+            self.insert(value)
 
-        if self.overloaded:
-            self._allocate_next()
 
-    def remove(self, value, *, byhash=False):
+class DictMap:
+    """ Same interface as HashMap, on top of the built-in dict.
+
+    HashMap shows how it's done, this one is how fast it can be done.
+    LoxStrings hash to their own `hash`, so seeding still applies to them.
+    """
+    def __init__(self, initializer=None):
+        # Values sit in one-item lists, which are what slot() hands out
+        self.table = {}
+        self.version = 0
+        if initializer:
+            self.insert_all(initializer)
+
+    def insert(self, key, value, *, byhash=False):
         if isinstance(key, str):
             key = bytes(key, "ascii")
 
-        if not byhash:
-            hsh = fnv1a(key)
-        else:
-            hsh = key
-
-        idx = hsh & (self.capacity - 1)
-        removed = False
-        while not removed:
-            cidx = self.indices[idx]
-            if cidx is None:
-                # Not present
-                return
+        cell = self.table.get(key)
+        if cell is not None:
+            cell[0] = value
+            return True
 
-            if self.hashes[cidx] == hsh:
-                # Make a tombstone
-                self.indices[idx] = False
-                # In case we're removing the first or the last
-                # element, just pop the values
-                if (cidx == 0 and self.count == 1) or cidx == self.count - 1:
-                    self.hashes.pop()
-                    self.values.pop()
-                    break
+        self.table[key] = [value]
+        self.version += 1
+        return False
 
-                # Otherwise, fill the gap
-                lasthash = self.hashes[-1]
-                lastidx = lasthash & (self.capacity - 1)
-                # Resolve collisions once again
-                while not removed:
-                    lastcidx = self.indices[lastidx]
-                    if self.hashes[lastcidx] == lasthash:
-                        self.indices[lastidx] = cidx
-                        self.hashes[cidx] = self.hashes.pop()
-                        self.values[cidx] = self.values.pop()
-                        removed = True
-                    else:
-                        lastcidx += 1
-                        if lastcidx == self.capacity:
-                            lastcidx = 0
-            else:
-                idx += 1
-                if idx == self.capacity:
-                    idx = 0
+    def insert_all(self, it):
+        if isinstance(it, dict):
+            it = it.items()
+
+        for key, value in it:
+            self.insert(key, value)
+
+    def get(self, key, *, byhash=False):
+        if isinstance(key, str):
+            key = bytes(key, "ascii")
+
+        cell = self.table.get(key)
+        if cell is not None:
+            return cell[0]
+
+    def remove(self, key, *, byhash=False):
+        if isinstance(key, str):
+            key = bytes(key, "ascii")
+
+        if self.table.pop(key, None) is not None:
+            self.version += 1
+
+    def contains(self, key, *, byhash=False):
+        if isinstance(key, str):
+            key = bytes(key, "ascii")
+
+        return key in self.table
+
+    def slot(self, key):
+        """ Where the value of `key` lives, until `version` changes """
+        if isinstance(key, str):
+            key = bytes(key, "ascii")
+
+        return self.table.get(key)
+
+    def value_at(self, slot):
+        return slot[0]
+
+    def items(self):
+        return ((key, cell[0]) for key, cell in self.table.items())
+
+    @property
+    def count(self):
+        return len(self.table)
+
+    def __contains__(self, key):
+        return self.contains(key)
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __len__(self):
+        return len(self.table)
+
+
+# Table backends the VM can be built with. Globals and interned strings
+# grow while scripts run, so ours rehashes them incrementally
+BACKENDS = {
+    "hashmap": partial(HashMap, incremental=True),
+    "dict": DictMap,
+}
+
+
+set_hash_seed(seed_from_environment())
@@ -0,0 +1,60 @@
+from .exceptions import LoxMemoryError
+
+
+# Rough costs of what doesn't have a buffer of its own to measure
+CONSTANT_SIZE = 8
+GLOBAL_SIZE = 32
+
+
+class MemoryAccount:
+    """ Bytes allocated by one VM, with an optional quota.
+
+    Objects are charged when they reach the VM (interning, concatenation,
+    natives' results, growth of maps and arrays) and credited back when
+    they're collected. Sizes are the logical ones: a concatenation is
+    charged its full length even while it's still an unflattened rope,
+    since that's what it takes once something needs its contents.
+    """
+    def __init__(self, quota=None):
+        self.quota = quota
+        self.live = 0
+        self.peak = 0
+        # line -> [bytes, allocations]
+        self.by_line = {}
+        # The line the VM is at, set by the VM: None stands for compilation
+        self.locate = lambda: None
+
+    def charge(self, nbytes):
+        if self.quota is not None and self.live + nbytes > self.quota:
+            raise LoxMemoryError(f"Out of memory: quota of {self.quota} bytes exceeded.")
+
+        self.live += nbytes
+        if self.live > self.peak:
+            self.peak = self.live
+
+        stats = self.by_line.setdefault(self.locate(), [0, 0])
+        stats[0] += nbytes
+        stats[1] += 1
+
+    def release(self, nbytes):
+        self.live -= nbytes
+
+    def adopt(self, obj):
+        """ Charge `obj` for what it grew since last time, and credit it back once gone """
+        nbytes = obj.nbytes
+        charged = obj._charged if obj._account is self else 0
+        if nbytes > charged:
+            self.charge(nbytes - charged)
+            obj._account = self
+            obj._charged = nbytes
+
+        return obj
+
+    def report(self):
+        lines = [f"live {self.live} bytes, peak {self.peak} bytes"]
+        hot = sorted(self.by_line.items(), key=lambda item: item[1][0], reverse=True)
+        for line, (nbytes, count) in hot:
+            where = "compile" if line is None else f"line {line}"
+            lines.append(f"  {where:>10}: {nbytes:10} bytes in {count} allocations")
+
+        return "\n".join(lines)
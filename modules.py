@@ -0,0 +1,157 @@
+import hashlib
+import marshal
+import os
+
+from .opcodes import OPCODES
+from .exceptions import LoxVerifyError
+from .scanner import Scanner, TokenType
+from . import chunk, compiler, hashmap, types, verifier
+
+
+# Compiled modules are cached next to their sources, like __pycache__
+CACHE_DIR = "__ploxcache__"
+
+# Bytecode is only valid for the instruction set it was compiled with
+MAGIC = hashlib.sha256(" ".join(OPCODES).encode("ascii")).hexdigest()[:16]
+
+
+def resolve(path, importer=None):
+    """ Absolute path of module `path`, relative to the directory of the importing one """
+    base = os.path.dirname(importer) if importer is not None else os.getcwd()
+    return os.path.abspath(os.path.join(base, path))
+
+
+def imports_of(source):
+    """ Paths of the modules `source` imports, as written """
+    scanner = Scanner()
+    scanner.init(source)
+    paths = []
+    previous = None
+    while True:
+        token = scanner.scan_token()
+        if token is None:
+            continue
+
+        if token.type is TokenType.EOF:
+            return paths
+
+        if token.type is TokenType.STRING and previous is not None and previous.type is TokenType.IMPORT:
+            paths.append(token.lexeme[1:-1])
+
+        previous = token
+
+
+def dependency_graph(root, infer=False):
+    """ Every module `root` imports, directly or not: path -> paths it imports.
+
+    Modules already in the cache aren't scanned, their imports are in there
+    too. Modules that can't be read map to None.
+    """
+    graph = {}
+    pending = [resolve(root)]
+    while pending:
+        path = pending.pop()
+        if path in graph:
+            continue
+
+        try:
+            source = read_source(path)
+        except OSError:
+            graph[path] = None
+            continue
+
+        cached = _read_cache(path, source_key(source, infer))
+        imported = cached[0] if cached is not None else imports_of(source)
+        graph[path] = [resolve(name, path) for name in imported]
+        pending.extend(graph[path])
+
+    return graph
+
+
+def read_source(path):
+    with open(path, encoding="utf8") as f:
+        return f.read()
+
+
+def source_key(source, infer=False):
+    """ What a module's bytecode depends on: its contents and how it's compiled """
+    digest = hashlib.sha256(f"{MAGIC} {int(infer)}\n".encode("ascii"))
+    digest.update(source.encode("utf8"))
+    return digest.hexdigest()
+
+
+def cache_path(path, key):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, CACHE_DIR, f"{name}.{key[:16]}.ploxc")
+
+
+def _read_cache(path, key):
+    # The imports, code, lines and constants
+    try:
+        with open(cache_path(path, key), "rb") as f:
+            magic, *cached = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    return cached if magic == MAGIC and len(cached) == 4 else None
+
+
+def read_cache(path, key, strings):
+    """ The chunk cached for module `path` with contents `key`, verified.
+
+    None if there's none, or it doesn't verify: it's compiled again then.
+    """
+    cached = _read_cache(path, key)
+    if cached is None:
+        return None
+
+    _, code, lines, constants = cached
+    constants = [strings.intern(c) if isinstance(c, str) else c for c in constants]
+    cnk = chunk.Chunk.load(code, lines, constants)
+    try:
+        verifier.verify(cnk)
+    except LoxVerifyError:
+        return None
+
+    return cnk
+
+
+def write_cache(path, key, cnk, imports):
+    code, lines, constants = cnk.dump()
+    constants = [str(c) if isinstance(c, types.LoxString) else c for c in constants]
+    target = cache_path(path, key)
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Written aside then moved in place: concurrent builds never see half a file
+        partial = f"{target}.{os.getpid()}"
+        with open(partial, "wb") as f:
+            marshal.dump((MAGIC, imports, code, lines, constants), f)
+
+        os.replace(partial, target)
+    except OSError:
+        # A read-only tree only means no caching
+        pass
+
+
+def build_module(path, infer=False):
+    """ Compile module `path` into the cache unless it's there already.
+
+    Meant to run in worker processes: returns `path` along with "built",
+    "cached" or "error".
+    """
+    try:
+        source = read_source(path)
+    except OSError:
+        return path, "error"
+
+    key = source_key(source, infer)
+    if os.path.exists(cache_path(path, key)):
+        return path, "cached"
+
+    cnk = chunk.Chunk()
+    comp = compiler.Compiler(types.StringTable(hashmap.DictMap), infer=infer)
+    if not comp.compile(source, cnk):
+        return path, "error"
+
+    write_cache(path, key, cnk, comp.imports)
+    return path, "built"
@@ -0,0 +1,197 @@
+import math
+import time
+
+from .exceptions import LoxRuntimeError
+from . import types, value
+
+
+def _number(name, arg):
+    if not isinstance(arg, float):
+        raise LoxRuntimeError(f"{name}() expects a number.")
+
+    return arg
+
+
+def _finite(name, arg):
+    # int() and math.floor() can't take infinities or NaN
+    arg = _number(name, arg)
+    if not math.isfinite(arg):
+        raise LoxRuntimeError(f"{name}() expects a finite number.")
+
+    return arg
+
+
+def _string(name, arg):
+    if not isinstance(arg, types.LoxString):
+        raise LoxRuntimeError(f"{name}() expects a string.")
+
+    return arg
+
+
+def _array(name, arg):
+    if not isinstance(arg, types.LoxArray):
+        raise LoxRuntimeError(f"{name}() expects an array.")
+
+    return arg
+
+
+def _same_size(name, a, b):
+    a, b = _array(name, a), _array(name, b)
+    if len(a) != len(b):
+        raise LoxRuntimeError(f"{name}() expects arrays of the same size.")
+
+    return a, b
+
+
+def clock():
+    return time.perf_counter()
+
+
+def sqrt(x):
+    x = _number("sqrt", x)
+    if x < 0:
+        raise LoxRuntimeError("sqrt() of a negative number.")
+
+    return math.sqrt(x)
+
+
+def floor(x):
+    return float(math.floor(_finite("floor", x)))
+
+
+def abs_(x):
+    return abs(_number("abs", x))
+
+
+def pow_(x, y):
+    try:
+        return math.pow(_number("pow", x), _number("pow", y))
+    except (ValueError, OverflowError):
+        raise LoxRuntimeError("pow() result out of range.")
+
+
+def len_(s):
+    if isinstance(s, (types.LoxArray, types.LoxMap)):
+        return float(len(s))
+
+    return float(_string("len", s).length)
+
+
+def str_(x):
+    return types.LoxString(value.format_value(x))
+
+
+def num(s):
+    try:
+        return float(str(_string("num", s)))
+    except ValueError:
+        return None
+
+
+def substr(s, start, length):
+    s = str(_string("substr", s))
+    start = int(_finite("substr", start))
+    length = int(_finite("substr", length))
+    return types.LoxString(s[start:start + length])
+
+
+def array_(*args):
+    """ array(size), array(size, fill), or array() for an empty one """
+    if len(args) > 2:
+        raise LoxRuntimeError("array() takes a size and a fill value.")
+
+    size = _finite("array", args[0]) if args else 0.0
+    if size != int(size) or size < 0:
+        raise LoxRuntimeError("array() size must be a non-negative integer.")
+
+    fill = _number("array", args[1]) if len(args) == 2 else 0.0
+    return types.LoxArray.filled(int(size), fill)
+
+
+def get(array, index):
+    return _array("get", array).get(index)
+
+
+def set_(array, index, value):
+    _array("set", array).set(index, value)
+    return value
+
+
+def push(array, value):
+    _array("push", array).values.append(_number("push", value))
+    return array
+
+
+def sum_(array):
+    return _array("sum", array).sum()
+
+
+def dot(a, b):
+    a, b = _same_size("dot", a, b)
+    return a.dot(b)
+
+
+def scale(array, factor):
+    return _array("scale", array).scale(_number("scale", factor))
+
+
+def add(a, b):
+    a, b = _same_size("add", a, b)
+    return a.add(b)
+
+
+def _map(name, arg):
+    if not isinstance(arg, types.LoxMap):
+        raise LoxRuntimeError(f"{name}() expects a map.")
+
+    return arg
+
+
+def map_():
+    return types.LoxMap()
+
+
+def has(lmap, key):
+    return _map("has", lmap).contains(key)
+
+
+def remove(lmap, key):
+    _map("remove", lmap).remove(key)
+    return None
+
+
+def keyat(lmap, position):
+    """ Iterating over a map: keyat(m, i) for i from 0 to len(m) - 1 """
+    lmap = _map("keyat", lmap)
+    position = _number("keyat", position)
+    # The range check first: it also rules out infinities and NaN, which int() can't take
+    if not 0 <= position < len(lmap) or position != int(position):
+        raise LoxRuntimeError("Map position out of range.")
+
+    return lmap.key_at(int(position))
+
+
+# name: (function, arity)
+NATIVES = {
+    "clock": (clock, 0),
+    "sqrt": (sqrt, 1),
+    "floor": (floor, 1),
+    "abs": (abs_, 1),
+    "pow": (pow_, 2),
+    "len": (len_, 1),
+    "str": (str_, 1),
+    "num": (num, 1),
+    "substr": (substr, 3),
+    "array": (array_, None),
+    "get": (get, 2),
+    "set": (set_, 3),
+    "push": (push, 2),
+    "sum": (sum_, 1),
+    "dot": (dot, 2),
+    "scale": (scale, 2),
+    "add": (add, 2),
+    "map": (map_, 0),
+    "has": (has, 2),
+    "remove": (remove, 2),
+    "keyat": (keyat, 2),
+}
@@ -14,10 +14,30 @@ OPCODES_SIMPLE = [
     "OP_GREATER",
     "OP_LESS",
     "OP_RETURN",
+    # Specialized at runtime, never emitted by the compiler
+    "OP_ADD_NUM",
+    "OP_ADD_STR",
+    "OP_SUBTRACT_NUM",
+    "OP_MULTIPLY_NUM",
+    "OP_DIVIDE_NUM",
+    "OP_GREATER_NUM",
+    "OP_LESS_NUM",
+    # Emitted when the compiler proved the operand types, so without any check
+    "OP_ADD_NUM_UNCHECKED",
+    "OP_ADD_STR_UNCHECKED",
+    "OP_SUBTRACT_UNCHECKED",
+    "OP_MULTIPLY_UNCHECKED",
+    "OP_DIVIDE_UNCHECKED",
+    "OP_GREATER_UNCHECKED",
+    "OP_LESS_UNCHECKED",
+    "OP_NEGATE_UNCHECKED",
+    "OP_GET_INDEX",
+    "OP_SET_INDEX",
 ]
 
 OPCODES_CONSTANT = [
     "OP_CONSTANT",
+    "OP_IMPORT",
 ]
 
 OPCODES_BYTEINSTR = [
@@ -26,6 +46,17 @@ OPCODES_BYTEINSTR = [
     "OP_GET_GLOBAL",
     "OP_DEFINE_GLOBAL",
     "OP_SET_GLOBAL",
+    "OP_GET_GLOBAL_CACHED",
+    "OP_CALL",
+]
+
+# Same as their byte counterparts, with a two-byte constant index
+OPCODES_LONG = [
+    "OP_CONSTANT_LONG",
+    "OP_GET_GLOBAL_LONG",
+    "OP_DEFINE_GLOBAL_LONG",
+    "OP_SET_GLOBAL_LONG",
+    "OP_IMPORT_LONG",
 ]
 
 OPCODES_JUMPINSTR = [
@@ -34,7 +65,7 @@ OPCODES_JUMPINSTR = [
     "OP_LOOP"
 ]
 
-OPCODES = [*OPCODES_SIMPLE, *OPCODES_CONSTANT, *OPCODES_BYTEINSTR, *OPCODES_JUMPINSTR]
+OPCODES = [*OPCODES_SIMPLE, *OPCODES_CONSTANT, *OPCODES_BYTEINSTR, *OPCODES_LONG, *OPCODES_JUMPINSTR]
 
 for machcode, opcode in enumerate(OPCODES):
     globals()[opcode] = machcode
@@ -1,22 +1,53 @@
+import os
 import sys
+from .coverage import Coverage
 from .enums import VMResult
-from .error_machinery import ErrorMachinery
-from . import vm
+from . import typeprofile, vm
 
 
-errmac = ErrorMachinery()
+class Plox:
+    def __init__(self, table="dict", profile=None, infer=False, quota=None, memory_report=False,
+            coverage=None):
+        # With a profile path, the first run records the operand types there,
+        # and the next ones compile specialized instructions from them
+        self.profile_path = profile
+        self.recording = None
+        feedback = None
+        if profile is not None:
+            if os.path.exists(profile):
+                feedback = typeprofile.TypeProfile.load(profile)
+            else:
+                self.recording = typeprofile.TypeProfile()
 
+        self.memory_report = memory_report
+        self.vm = vm.VM(table, feedback, infer, quota)
+        if self.recording is not None:
+            self.vm.record_profile(self.recording)
 
-class Plox:
-    def __init__(self):
-        self.vm = vm.VM()
+        # With a coverage path, execution counts add up to the ones saved there
+        self.coverage_path = coverage
+        self.coverage = None
+        if coverage is not None:
+            self.coverage = Coverage.load(coverage) if os.path.exists(coverage) else Coverage()
+            self.vm.record_coverage(self.coverage)
+
+    def define_native(self, name, function, arity=None):
+        self.vm.define_native(name, function, arity)
+
+    def prepare(self, source, path=None):
+        """ Compile `source` once, see `VM.prepare` """
+        return self.vm.prepare(source, path)
+
+    def execute(self, program, bindings=None, result=None):
+        """ Run a prepared program on this interpreter's VM, see `VM.execute` """
+        return self.vm.execute(program, bindings, result)
 
-    def run(self, source):
+    def run(self, source, path=None):
         self.vm.init()
-        return self.vm.interpret(source)
+        return self.vm.interpret(source, path)
 
-    def run_oneshot(self, source):
-        out = self.run(source)
+    def run_oneshot(self, source, path=None):
+        out = self.run(source, path)
         if out is VMResult.COMPILE_ERROR:
             sys.exit(65)
         elif out is VMResult.RUNTIME_ERROR:
@@ -25,15 +56,27 @@ class Plox:
         return out
 
     def run_interactive(self, source):
-        result = self.run(source)
-        errmac.reset()
+        result = self.vm.interpret_incremental(source)
+        self.vm.errors.reset()
         return result
 
     def run_file(self, filename):
         with open(filename, encoding="utf8") as f:
-            out = self.run_oneshot(f.read())
+            source = f.read()
+
+        try:
+            out = self.run_oneshot(source, filename)
             if out:
                 print(out)
+        finally:
+            if self.recording is not None:
+                self.recording.save(self.profile_path)
+
+            if self.coverage is not None:
+                self.coverage.save(self.coverage_path)
+
+            if self.memory_report:
+                print(self.vm.memory.report(), file=sys.stderr)
 
     def repl(self):
         while True:
@@ -41,6 +84,9 @@ class Plox:
                 source = input("% ")
             except (KeyboardInterrupt, EOFError) as e:
                 print(e.__class__.__name__)
+                if self.coverage is not None:
+                    self.coverage.save(self.coverage_path)
+
                 sys.exit(0)
 
             if source:
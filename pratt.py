@@ -1,96 +1,173 @@
-from collections import namedtuple
-
-from .scanner import TokenType
-from .compiler import Precedence
-
-
-ParseRule = namedtuple("ParseRule", ["prefix", "infix", "precedence"])
-
-
-def and_(inst, can_assign):
-   return inst._and_(can_assign)
-
-
-def binary(inst, can_assign):
-   return inst._binary(can_assign)
-
-
-def grouping(inst, can_assign):
-   return inst._grouping(can_assign)
-
-
-def literal(inst, can_assign):
-   return inst._literal(can_assign)
-
-
-def number(inst, can_assign):
-   return inst._number(can_assign)
-
-
-def or_(inst, can_assign):
-   return inst._or_(can_assign)
-
-
-def string(inst, can_assign):
-   return inst._string(can_assign)
-
-
-def unary(inst, can_assign):
-   return inst._unary(can_assign)
-
-
-def variable(inst, can_assign):
-   return inst._variable(can_assign)
-
-
-RULES = {
-    TokenType.LEFT_PAREN: ParseRule(grouping, None, Precedence.NONE),
-    TokenType.RIGHT_PAREN: ParseRule(None, None, Precedence.NONE),
-    TokenType.LEFT_BRACE: ParseRule(None, None, Precedence.NONE),
-    TokenType.RIGHT_BRACE: ParseRule(None, None, Precedence.NONE),
-    TokenType.COMMA: ParseRule(None, None, Precedence.NONE),
-    TokenType.DOT: ParseRule(None, None, Precedence.NONE),
-    TokenType.MINUS: ParseRule(unary, binary, Precedence.TERM),
-    TokenType.PLUS: ParseRule(None, binary, Precedence.TERM),
-    TokenType.SEMICOLON: ParseRule(None, None, Precedence.NONE),
-    TokenType.SLASH: ParseRule(None, binary, Precedence.FACTOR),
-    TokenType.STAR: ParseRule(None, binary, Precedence.FACTOR),
-    TokenType.COLON: ParseRule(None, None, Precedence.NONE),
-    TokenType.QUERY: ParseRule(None, None, Precedence.NONE),
-    TokenType.BANG: ParseRule(unary, None, Precedence.NONE),
-    TokenType.BANG_EQUAL: ParseRule(None, binary, Precedence.EQUALITY),
-    TokenType.EQUAL: ParseRule(None, None, Precedence.NONE),
-    TokenType.EQUAL_EQUAL: ParseRule(None, binary, Precedence.EQUALITY),
-    TokenType.GREATER: ParseRule(None, binary, Precedence.COMPARISON),
-    TokenType.GREATER_EQUAL: ParseRule(None, binary, Precedence.COMPARISON),
-    TokenType.LESS: ParseRule(None, binary, Precedence.COMPARISON),
-    TokenType.LESS_EQUAL: ParseRule(None, binary, Precedence.COMPARISON),
-    TokenType.PLUS_PLUS: ParseRule(None, None, Precedence.NONE),
-    TokenType.MINUS_MINUS: ParseRule(None, None, Precedence.NONE),
-    TokenType.IDENTIFIER: ParseRule(variable, None, Precedence.NONE),
-    TokenType.STRING: ParseRule(string, None, Precedence.NONE),
-    TokenType.NUMBER: ParseRule(number, None, Precedence.NONE),
-    TokenType.AND: ParseRule(None, and_, Precedence.AND),
-    TokenType.CLASS: ParseRule(None, None, Precedence.NONE),
-    TokenType.ELSE: ParseRule(None, None, Precedence.NONE),
-    TokenType.FALSE: ParseRule(literal, None, Precedence.NONE),
-    TokenType.FUN: ParseRule(None, None, Precedence.NONE),
-    TokenType.FOR: ParseRule(None, None, Precedence.NONE),
-    TokenType.IF: ParseRule(None, None, Precedence.NONE),
-    TokenType.NIL: ParseRule(literal, None, Precedence.NONE),
-    TokenType.OR: ParseRule(None, or_, Precedence.OR),
-    TokenType.PRINT: ParseRule(None, None, Precedence.NONE),
-    TokenType.RETURN: ParseRule(None, None, Precedence.NONE),
-    TokenType.SUPER: ParseRule(None, None, Precedence.NONE),
-    TokenType.THIS: ParseRule(None, None, Precedence.NONE),
-    TokenType.TRUE: ParseRule(literal, None, Precedence.NONE),
-    TokenType.VAR: ParseRule(None, None, Precedence.NONE),
-    TokenType.WHILE: ParseRule(None, None, Precedence.NONE),
-    TokenType.LOOP: ParseRule(None, None, Precedence.NONE),
-    TokenType.BREAK: ParseRule(None, None, Precedence.NONE),
-    TokenType.COMMENT: ParseRule(None, None, Precedence.NONE),
-    TokenType.ERROR: ParseRule(None, None, Precedence.NONE),
-    TokenType.EOF: ParseRule(None, None, Precedence.NONE),
-    TokenType.NEWLINE: ParseRule(None, None, Precedence.NONE),
-    TokenType.UNUSEFUL: ParseRule(None, None, Precedence.NONE),
-}
+# Generated by tools/rules_gen.py, do not edit.
+#
+# Tables indexed by TokenType: for each token, the Compiler method parsing it
+# as a prefix and as an infix (minus its leading underscore), and its
+# precedence as an infix operator.
+
+PREFIX = (
+    None,  # unused
+    "grouping",  # LEFT_PAREN
+    None,  # RIGHT_PAREN
+    None,  # LEFT_BRACE
+    None,  # RIGHT_BRACE
+    None,  # LEFT_BRACKET
+    None,  # RIGHT_BRACKET
+    None,  # COMMA
+    None,  # DOT
+    "unary",  # MINUS
+    None,  # PLUS
+    None,  # SEMICOLON
+    None,  # SLASH
+    None,  # STAR
+    None,  # COLON
+    None,  # QUERY
+    "unary",  # BANG
+    None,  # BANG_EQUAL
+    None,  # EQUAL
+    None,  # EQUAL_EQUAL
+    None,  # GREATER
+    None,  # GREATER_EQUAL
+    None,  # LESS
+    None,  # LESS_EQUAL
+    None,  # PLUS_PLUS
+    None,  # MINUS_MINUS
+    "variable",  # IDENTIFIER
+    "string",  # STRING
+    "number",  # NUMBER
+    None,  # AND
+    None,  # CLASS
+    None,  # ELSE
+    "literal",  # FALSE
+    None,  # FUN
+    None,  # FOR
+    None,  # IF
+    "literal",  # NIL
+    None,  # OR
+    None,  # PRINT
+    None,  # RETURN
+    None,  # SUPER
+    None,  # THIS
+    "literal",  # TRUE
+    None,  # VAR
+    None,  # WHILE
+    None,  # LOOP
+    None,  # BREAK
+    None,  # IMPORT
+    None,  # COMMENT
+    None,  # ERROR
+    None,  # EOF
+    None,  # NEWLINE
+    None,  # UNUSEFUL
+)
+
+INFIX = (
+    None,  # unused
+    "call",  # LEFT_PAREN
+    None,  # RIGHT_PAREN
+    None,  # LEFT_BRACE
+    None,  # RIGHT_BRACE
+    "index",  # LEFT_BRACKET
+    None,  # RIGHT_BRACKET
+    None,  # COMMA
+    None,  # DOT
+    "binary",  # MINUS
+    "binary",  # PLUS
+    None,  # SEMICOLON
+    "binary",  # SLASH
+    "binary",  # STAR
+    None,  # COLON
+    None,  # QUERY
+    None,  # BANG
+    "binary",  # BANG_EQUAL
+    None,  # EQUAL
+    "binary",  # EQUAL_EQUAL
+    "binary",  # GREATER
+    "binary",  # GREATER_EQUAL
+    "binary",  # LESS
+    "binary",  # LESS_EQUAL
+    None,  # PLUS_PLUS
+    None,  # MINUS_MINUS
+    None,  # IDENTIFIER
+    None,  # STRING
+    None,  # NUMBER
+    "and_",  # AND
+    None,  # CLASS
+    None,  # ELSE
+    None,  # FALSE
+    None,  # FUN
+    None,  # FOR
+    None,  # IF
+    None,  # NIL
+    "or_",  # OR
+    None,  # PRINT
+    None,  # RETURN
+    None,  # SUPER
+    None,  # THIS
+    None,  # TRUE
+    None,  # VAR
+    None,  # WHILE
+    None,  # LOOP
+    None,  # BREAK
+    None,  # IMPORT
+    None,  # COMMENT
+    None,  # ERROR
+    None,  # EOF
+    None,  # NEWLINE
+    None,  # UNUSEFUL
+)
+
+PRECEDENCE = (
+    1,  # unused
+    10,  # LEFT_PAREN: CALL
+    1,  # RIGHT_PAREN: NONE
+    1,  # LEFT_BRACE: NONE
+    1,  # RIGHT_BRACE: NONE
+    10,  # LEFT_BRACKET: CALL
+    1,  # RIGHT_BRACKET: NONE
+    1,  # COMMA: NONE
+    1,  # DOT: NONE
+    7,  # MINUS: TERM
+    7,  # PLUS: TERM
+    1,  # SEMICOLON: NONE
+    8,  # SLASH: FACTOR
+    8,  # STAR: FACTOR
+    1,  # COLON: NONE
+    1,  # QUERY: NONE
+    1,  # BANG: NONE
+    5,  # BANG_EQUAL: EQUALITY
+    1,  # EQUAL: NONE
+    5,  # EQUAL_EQUAL: EQUALITY
+    6,  # GREATER: COMPARISON
+    6,  # GREATER_EQUAL: COMPARISON
+    6,  # LESS: COMPARISON
+    6,  # LESS_EQUAL: COMPARISON
+    1,  # PLUS_PLUS: NONE
+    1,  # MINUS_MINUS: NONE
+    1,  # IDENTIFIER: NONE
+    1,  # STRING: NONE
+    1,  # NUMBER: NONE
+    4,  # AND: AND
+    1,  # CLASS: NONE
+    1,  # ELSE: NONE
+    1,  # FALSE: NONE
+    1,  # FUN: NONE
+    1,  # FOR: NONE
+    1,  # IF: NONE
+    1,  # NIL: NONE
+    3,  # OR: OR
+    1,  # PRINT: NONE
+    1,  # RETURN: NONE
+    1,  # SUPER: NONE
+    1,  # THIS: NONE
+    1,  # TRUE: NONE
+    1,  # VAR: NONE
+    1,  # WHILE: NONE
+    1,  # LOOP: NONE
+    1,  # BREAK: NONE
+    1,  # IMPORT: NONE
+    1,  # COMMENT: NONE
+    1,  # ERROR: NONE
+    1,  # EOF: NONE
+    1,  # NEWLINE: NONE
+    1,  # UNUSEFUL: NONE
+)
@@ -0,0 +1,123 @@
+import weakref
+from array import array
+from copy import copy
+
+from .exceptions import LoxRuntimeError
+from . import memory, types, verifier
+
+
+def to_lox(obj, account=None):
+    """ The Lox value for the Python `obj`.
+
+    Strings aren't interned, like concatenation results: that would mean
+    hashing every one of them, for values that are mostly only read.
+    Every string, array and map of it, nested ones included, is charged to
+    the MemoryAccount `account` if any, as soon as it's built.
+    """
+    if obj is None or obj is True or obj is False:
+        return obj
+    elif isinstance(obj, (int, float)):
+        return float(obj)
+    elif isinstance(obj, str):
+        return _adopt(types.LoxString(obj), account)
+    elif isinstance(obj, types.LoxObject):
+        return _adopt(obj, account)
+    elif isinstance(obj, dict):
+        lmap = types.LoxMap()
+        for key, val in obj.items():
+            lmap.set(to_lox(key, account), to_lox(val, account))
+            _adopt(lmap, account)
+
+        return _adopt(lmap, account)
+    elif isinstance(obj, (list, tuple)):
+        try:
+            return _adopt(types.LoxArray(array('d', obj)), account)
+        except TypeError:
+            raise LoxRuntimeError("Only lists of numbers can be bound, as arrays.")
+
+    raise LoxRuntimeError(f"Can't bind a {type(obj).__name__} to a Lox value.")
+
+
+def _adopt(obj, account):
+    if account is not None and isinstance(obj, (types.LoxString, types.LoxArray, types.LoxMap)):
+        account.adopt(obj)
+
+    return obj
+
+
+def to_python(val):
+    """ The Python object for the Lox value `val`: maps and arrays are copied """
+    if isinstance(val, types.LoxString):
+        return str(val)
+    elif isinstance(val, types.LoxArray):
+        return list(val.values)
+    elif isinstance(val, types.LoxMap):
+        return {to_python(key): to_python(v) for key, v in val.items()}
+
+    # nil, booleans, numbers, and natives as they are
+    return val
+
+
+class Program:
+    """ Script compiled once, to be run any number of times, on any VM.
+
+    Its chunk is verified, raising LoxVerifyError if it's unsafe to run,
+    and frozen: every run gets a copy of the code to quicken.
+    Its strings are interned in the table of the VM that compiled it, and
+    re-interned once per other table it runs against, since the VM compares
+    interned strings by identity.
+    Its constant pool stays charged to `account`, if any, as long as it lives.
+    """
+    # The MemoryAccount its constant pool is charged to, and how much
+    _account = None
+    _charged = 0
+
+    def __init__(self, cnk, strings, path=None, account=None):
+        if account is not None:
+            self._account = account
+            self._charged = cnk.constants.count * memory.CONSTANT_SIZE
+
+        verifier.verify(cnk)
+        cnk.freeze()
+        self.chunk = cnk
+        self.strings = strings
+        self.path = path
+        # String table -> constants interned in it
+        self._linked = weakref.WeakKeyDictionary()
+
+    def __del__(self):
+        if self._account is not None:
+            self._account.release(self._charged)
+
+    def instance(self, strings):
+        """ A copy of the chunk to run on a VM interning in `strings` """
+        inst = self.chunk.instance()
+        if strings is self.strings:
+            return inst
+
+        constants = self._linked.get(strings)
+        if constants is None:
+            constants = tuple(
+                strings.intern(str(c)) if isinstance(c, types.LoxString) else c
+                for c in self.chunk.constants.values
+            )
+            self._linked[strings] = constants
+
+        inst.constants = copy(self.chunk.constants)
+        inst.constants.values = constants
+        return inst
+
+
+def results(vm, result=None):
+    """ The global `result` once the script ran, or all globals but the natives """
+    if result is not None:
+        name = vm.strings.intern(result)
+        if not vm.globals.contains(name):
+            raise LoxRuntimeError(f"Undefined variable '{result}'")
+
+        return to_python(vm.globals.get(name))
+
+    return {
+        str(name): to_python(val) for name, val in vm.globals.items()
+        if not isinstance(val, types.LoxNative)
+    }
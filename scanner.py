@@ -1,12 +1,15 @@
-from enum import Enum, auto
+from enum import IntEnum, auto
 
 
-class TokenType(Enum):
+# Token types are ints, which index the parse rule tables of pratt.py
+class TokenType(IntEnum):
   # Single-character tokens.
   LEFT_PAREN = auto()
   RIGHT_PAREN = auto()
   LEFT_BRACE = auto()
   RIGHT_BRACE = auto()
+  LEFT_BRACKET = auto()
+  RIGHT_BRACKET = auto()
   COMMA = auto()
   DOT = auto()
   MINUS = auto()
@@ -53,6 +56,7 @@ class TokenType(Enum):
   WHILE = auto()
   LOOP = auto()
   BREAK = auto()
+  IMPORT = auto()
 
   # Specials.
   COMMENT = auto()
@@ -67,6 +71,8 @@ LEXEMES = {
     ")": TokenType.RIGHT_PAREN,
     "{": TokenType.LEFT_BRACE,
     "}": TokenType.RIGHT_BRACE,
+    "[": TokenType.LEFT_BRACKET,
+    "]": TokenType.RIGHT_BRACKET,
     ",": TokenType.COMMA,
     ".": TokenType.DOT,
     "-": TokenType.MINUS,
@@ -112,7 +118,8 @@ KEYWORDS = {
     "var": TokenType.VAR,
     "while": TokenType.WHILE,
     "loop": TokenType.LOOP,
-    "break": TokenType.BREAK
+    "break": TokenType.BREAK,
+    "import": TokenType.IMPORT
 }
 
 
@@ -124,7 +131,7 @@ class Token:
         self.length = len(lexeme)
 
     def __str__(self):
-        return f"{self.type} {self.lexeme}"
+        return f"{self.type.name} {self.lexeme}"
 
     def __repr__(self):
         if isinstance(self.lexeme, str):
@@ -132,7 +139,7 @@ class Token:
         else:
             lexeme = self.lexeme
 
-        return (f"{self.__class__.__name__}({self.type}, {lexeme},"
+        return (f"{self.__class__.__name__}({self.type.name}, {lexeme},"
             f" {self.line})")
 
 
@@ -0,0 +1,128 @@
+import io
+import sys
+from collections import deque
+from contextlib import redirect_stdout
+from itertools import islice
+from multiprocessing import Pool
+
+from .vm import VM
+
+
+# Inputs are read this much at a time
+BUFFER_SIZE = 1 << 20
+# Records per task, when sharded across processes
+BATCH_SIZE = 4096
+
+
+def read_records(paths):
+    """ Lines of the files at `paths` ("-" for stdin, the default), without their newline """
+    for path in paths or ["-"]:
+        if path == "-":
+            f = open(sys.stdin.fileno(), encoding="utf8", buffering=BUFFER_SIZE, closefd=False)
+        else:
+            f = open(path, encoding="utf8", buffering=BUFFER_SIZE)
+
+        with f:
+            for line in f:
+                yield line[:-1] if line.endswith("\n") else line
+
+
+class RecordRunner:
+    """ Script compiled once and run on every record, awk-style.
+
+    Each run sees the record as `line` and its number, from 1, as `NR`.
+    With `fields`, the record is also split on `separator` (whitespace if
+    None) into the map `fields`, numbered from 1, of `NF` entries.
+    Globals persist from a record to the next. Its imports are relative
+    to `path`, the script's own.
+    """
+    def __init__(self, source, fields=False, separator=None, path=None, **vm_options):
+        self.vm = VM(**vm_options)
+        self.program = self.vm.prepare(source, path)
+        self.fields = fields
+        self.separator = separator
+        # Interned once for all the records
+        self.names = {name: self.vm.strings.intern(name) for name in ("line", "NR", "NF", "fields")}
+
+    def run(self, number, line):
+        names = self.names
+        bindings = {names["line"]: line, names["NR"]: number}
+        if self.fields:
+            fields = line.split(self.separator)
+            bindings[names["NF"]] = len(fields)
+            bindings[names["fields"]] = dict(enumerate(fields, 1))
+
+        self.vm.run_program(self.program, bindings)
+
+
+def batches(records, size=BATCH_SIZE):
+    """ (number of the first record, records) for successive runs of `size` records """
+    records = iter(records)
+    start = 1
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+
+        yield start, batch
+        start += len(batch)
+
+
+_runner = None
+
+
+def _start_worker(source, fields, separator, path, vm_options):
+    global _runner
+    _runner = RecordRunner(source, fields, separator, path, **vm_options)
+
+
+def _run_batch(batch):
+    # The output of the batch, and the error that stopped it if any
+    start, records = batch
+    out = io.StringIO()
+    with redirect_stdout(out):
+        try:
+            for number, record in enumerate(records, start):
+                _runner.run(number, record)
+        except Exception as e:
+            return out.getvalue(), e
+
+    return out.getvalue(), None
+
+
+def run_stream(source, paths, fields=False, separator=None, jobs=1, path=None, **vm_options):
+    """ Run `source` on every record of `paths`, in order.
+
+    With several `jobs`, batches of records are sharded across that many
+    processes, and their outputs written back in the order of the records.
+    Each process has its own globals then: only the records of a batch are
+    seen in sequence. Errors are raised as LoxCompileError or
+    LoxRuntimeError, once the output of the records before is written.
+    `path` is the script's, which its imports are relative to.
+    """
+    if jobs <= 1:
+        runner = RecordRunner(source, fields, separator, path, **vm_options)
+        for number, record in enumerate(read_records(paths), 1):
+            runner.run(number, record)
+
+        return
+
+    # Compile errors are better reported once, here
+    VM(**vm_options).prepare(source, path)
+    with Pool(jobs, _start_worker, (source, fields, separator, path, vm_options)) as pool:
+        # A few batches ahead of the output, not the whole input
+        pending = deque()
+        for batch in batches(read_records(paths)):
+            pending.append(pool.apply_async(_run_batch, (batch,)))
+            if len(pending) > 2 * jobs:
+                _write(pending.popleft().get())
+
+        while pending:
+            _write(pending.popleft().get())
+
+
+def _write(result):
+    output, error = result
+    sys.stdout.write(output)
+    if error is not None:
+        raise error
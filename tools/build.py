@@ -0,0 +1,47 @@
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from .. import modules
+
+
+def build(root, jobs=None, infer=False):
+    """ Compile `root` and every module it imports into the bytecode cache.
+
+    Modules are compiled independently of each other, so the whole graph
+    is compiled at once across `jobs` processes. Returns path -> status.
+    """
+    graph = modules.dependency_graph(root, infer)
+    statuses = {path: "error" for path, imported in graph.items() if imported is None}
+    paths = [path for path, imported in graph.items() if imported is not None]
+    if jobs == 1 or len(paths) < 2:
+        results = map(modules.build_module, paths, repeat(infer))
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(modules.build_module, paths, repeat(infer)))
+
+    statuses.update(results)
+    return statuses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="tools.build",
+        description="Compile a script's dependency graph ahead of time, in parallel.")
+    parser.add_argument("script")
+    parser.add_argument("-j", "--jobs", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--infer", action="store_true", help="compile for PLOXINFER=1")
+    args = parser.parse_args(argv)
+
+    statuses = build(args.script, args.jobs, args.infer)
+    for path, status in sorted(statuses.items()):
+        if status == "error":
+            print(f"error: {path}", file=sys.stderr)
+
+    counts = {status: list(statuses.values()).count(status) for status in ("built", "cached", "error")}
+    print(", ".join(f"{count} {status}" for status, count in counts.items()), file=sys.stderr)
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+import argparse
+import sys
+
+from .. import modules
+from ..coverage import NO_FILE, Coverage, hints, render_html, render_text
+
+
+def merged(paths):
+    """ The Coverage saved in every one of `paths`, added up """
+    total = Coverage()
+    for path in paths:
+        total.merge(Coverage.load(path))
+
+    return total
+
+
+def read_sources(coverage):
+    """ path -> source of every file covered that can still be read """
+    sources = {}
+    for path in coverage.files:
+        if path == NO_FILE:
+            continue
+
+        try:
+            sources[path] = modules.read_source(path)
+        except OSError:
+            pass
+
+    return sources
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="tools.coverage",
+        description="Merge coverage saved by PLOXCOVERAGE runs into an annotated heat listing.")
+    parser.add_argument("coverage", nargs="+", help="coverage files, as saved with PLOXCOVERAGE=path")
+    parser.add_argument("--html", help="also write the listing to this HTML file")
+    parser.add_argument("-o", "--output", help="save the merged coverage to this file")
+    parser.add_argument("--top", type=int, default=10, help="hints of each kind to show")
+    args = parser.parse_args(argv)
+
+    coverage = merged(args.coverage)
+    sources = read_sources(coverage)
+    print(render_text(coverage, sources))
+    print(hints(coverage, args.top))
+    if args.html:
+        with open(args.html, "w", encoding="utf8") as f:
+            f.write(render_html(coverage, sources, args.top))
+
+    if args.output:
+        coverage.save(args.output)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,20 @@
 from pathlib import Path
-from textwrap import dedent
 
+from ..precedence import Precedence
 from ..scanner import TokenType
 
 
-IMPORTS = [
-    "from collections import namedtuple",
-    "",
-    "from .scanner import TokenType",
-    "from .compiler import Precedence",   
-]
-
 PREAMBLE = """\
-ParseRule = namedtuple("ParseRule", ["prefix", "infix", "precedence"])
+# Generated by tools/rules_gen.py, do not edit.
+#
+# Tables indexed by TokenType: for each token, the Compiler method parsing it
+# as a prefix and as an infix (minus its leading underscore), and its
+# precedence as an infix operator.
 """
 
 PRECEDENCES = {
-    TokenType.LEFT_PAREN: ["grouping", None, None],
+    TokenType.LEFT_PAREN: ["grouping", "call", "CALL"],
+    TokenType.LEFT_BRACKET: [None, "index", "CALL"],
     TokenType.MINUS: ["unary", "binary", "TERM"],
     TokenType.PLUS: [None, "binary", "TERM"],
     TokenType.SLASH: [None, "binary", "FACTOR"],
@@ -39,56 +37,43 @@ PRECEDENCES = {
 }
 
 
-def write_imports(f):
-    for line in IMPORTS:
-        f.write(f"{line}\n")
-
-    f.write("\n\n")
-
-
 def write_preamble(f):
-    f.write(f"{PREAMBLE}\n\n")
+    f.write(f"{PREAMBLE}\n")
 
 
-def write_precedences(f, tokens=TokenType):
-    functions = set()
-    lines = []
-    
-    for name, value in tokens.__members__.items():
-        tokprec = PRECEDENCES.get(value)
-        if tokprec:
-            prefix = tokprec[0]
-            infix = tokprec[1]
-            prec = tokprec[2]
-            if prefix:
-                functions.add(prefix)
-
-            if infix:
-                functions.add(infix)
+def write_table(f, name, rows):
+    f.write(f"{name} = (\n")
+    for cell, token in rows:
+        cell = f'"{cell}"' if isinstance(cell, str) else cell
+        f.write(f"    {cell},  # {token}\n")
+    f.write(")\n")
 
-            s = f"ParseRule({prefix}, {infix}, Precedence.{str(prec).upper()})"
-        else:
-            s = "ParseRule(None, None, Precedence.NONE)"
 
-        lines.append(f"    {value.__class__.__name__}.{name}: " + s)
+def write_rules(f, tokens=TokenType):
+    # Token types start at 1: slot 0 is never looked up
+    prefixes = [(None, "unused")]
+    infixes = [(None, "unused")]
+    precedences = [(int(Precedence.NONE), "unused")]
 
-    for function in sorted(functions):
-        f.write(dedent(f""" \
-            def {function}(inst, can_assign):
-                return inst._{function}(can_assign)
-            \n\n"""))
+    for name, value in tokens.__members__.items():
+        prefix, infix, prec = PRECEDENCES.get(value, [None, None, None])
+        prec = Precedence[prec] if prec else Precedence.NONE
+        assert value == len(prefixes), "token types must be numbered from 1, in order"
+        prefixes.append((prefix, name))
+        infixes.append((infix, name))
+        precedences.append((int(prec), f"{name}: {prec.name}"))
 
-    f.write("RULES = {\n")
-    for line in lines:
-        f.write(f"{line},\n")
-    f.write("}\n")
+    write_table(f, "PREFIX", prefixes)
+    f.write("\n")
+    write_table(f, "INFIX", infixes)
+    f.write("\n")
+    write_table(f, "PRECEDENCE", precedences)
 
 
 def main(fname):
     with open(fname, "w") as f:
-        write_imports(f)
         write_preamble(f)
-        write_precedences(f)
+        write_rules(f)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+import argparse
+import math
+import os
+import sys
+from contextlib import redirect_stdout
+from time import perf_counter
+
+from .. import chunk, scanner
+from ..scanner import TokenType
+from ..vm import VM
+
+
+DEFAULTS = {
+    "statements": 200,
+    "depth": 4,
+    "locals": 32,
+    "globals": 16,
+    "string": 64,
+}
+
+SWEEPS = {
+    "statements": [1000, 2000, 4000, 8000, 16000],
+    "depth": [4, 8, 16, 32, 64],
+    "locals": [16, 32, 64, 128, 240],
+    # Across the 256th constant, where globals switch to _LONG instructions
+    "globals": [16, 64, 256, 1024, 4096],
+    "string": [2**10, 2**13, 2**16, 2**19],
+}
+
+
+def generate(statements, depth, locals, globals, string):
+    """ Synthetic Lox program, with every knob scaling one dimension.
+
+    The bulk of the program only uses locals and literals that compile to
+    dedicated opcodes, so that constants go to the global names, one per
+    global since chunks store each constant once, and to a single string
+    of `string` bytes. Past 256 of them, globals are reached through the
+    _LONG instructions, up to the 65536 constants a chunk can hold.
+    """
+    lines = [f"var g{i} = true;" for i in range(globals)]
+    lines.append("{")
+    lines.append(f'var s = "{"x" * string}";')
+    lines.extend(f"var l{i} = true;" for i in range(locals))
+
+    # Spread the statements over `depth` nested blocks
+    per_block = max(statements // depth, 1)
+    for level in range(depth):
+        lines.append("{")
+        lines.append(f"var d{level} = nil;")
+        for n in range(per_block):
+            # Reach for locals all over the declared ones, old and recent
+            a, b, c = n % locals, (n * 7 + level) % locals, (n * 13 + 5) % locals
+            form = n % 4
+            if form == 0:
+                lines.append(f"l{a} = l{b} == l{c};")
+            elif form == 1:
+                lines.append(f"l{a} = !l{b};")
+            elif form == 2:
+                lines.append(f"if (l{a}) l{b} = l{c}; else d{level} = s == s;")
+            else:
+                lines.append(f"l{a} = l{b} and !l{c} or true;")
+
+    lines.extend("}" * depth)
+    lines.extend(f"g{i} = !g{i};" for i in range(0, globals, 2))
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def time_scanner(source):
+    scan = scanner.Scanner()
+    start = perf_counter()
+    scan.init(source)
+    while True:
+        token = scan.scan_token()
+        if token is not None and token.type is TokenType.EOF:
+            break
+
+    return perf_counter() - start
+
+
+def time_compiler(source, vm):
+    cnk = chunk.Chunk()
+    start = perf_counter()
+    if not vm.compiler.compile(source, cnk):
+        raise RuntimeError("generated program doesn't compile")
+
+    return perf_counter() - start, cnk
+
+
+def time_vm(vm, cnk):
+    vm.init()
+    vm.chunk = cnk
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        start = perf_counter()
+        vm.run()
+        return perf_counter() - start
+
+
+def measure(params, repeats):
+    source = generate(**params)
+    timings = {"scanner": [], "compiler": [], "vm": []}
+    for _ in range(repeats):
+        vm = VM()
+        timings["scanner"].append(time_scanner(source))
+        elapsed, cnk = time_compiler(source, vm)
+        timings["compiler"].append(elapsed)
+        timings["vm"].append(time_vm(vm, cnk))
+
+    return {phase: min(values) for phase, values in timings.items()}
+
+
+def fit_exponent(sizes, timings):
+    """ Slope of the least squares line through the log-log points """
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(timing) for timing in timings]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    num = sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+    den = sum((x - mx) ** 2 for x in xs)
+    return num / den
+
+
+def sweep(knob, sizes, repeats):
+    results = []
+    for size in sizes:
+        params = dict(DEFAULTS, **{knob: size})
+        result = measure(params, repeats)
+        results.append(result)
+        print(f"{knob:10} {size:8}  " + "  ".join(
+            f"{phase} {elapsed * 1e3:9.2f} ms" for phase, elapsed in result.items()))
+
+    # Fixed costs flatten the overall fit, the last two sizes tell the asymptote
+    exponents, tails = {}, {}
+    for phase in results[0]:
+        timings = [result[phase] for result in results]
+        exponents[phase] = fit_exponent(sizes, timings)
+        tails[phase] = fit_exponent(sizes[-2:], timings[-2:])
+
+    print(f"{knob:10} exponents " + "  ".join(
+        f"{phase} {exponents[phase]:5.2f} (tail {tails[phase]:5.2f})" for phase in exponents))
+    return tails
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="tools.scaling",
+        description="Time the scanner, compiler and VM on growing synthetic programs.")
+    parser.add_argument("knobs", nargs="*",
+        help=f"dimensions to sweep, among {', '.join(SWEEPS)} (default: all)")
+    parser.add_argument("-n", "--repeats", type=int, default=3)
+    parser.add_argument("--max-exponent", type=float,
+        help="exit with 1 if any tail exponent is above this")
+    args = parser.parse_args(argv)
+    for knob in args.knobs:
+        if knob not in SWEEPS:
+            parser.error(f"unknown dimension '{knob}'")
+
+    worst = 0
+    for knob in args.knobs or SWEEPS:
+        exponents = sweep(knob, SWEEPS[knob], args.repeats)
+        worst = max(worst, *exponents.values())
+
+    if args.max_exponent is not None and worst > args.max_exponent:
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
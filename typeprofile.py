@@ -0,0 +1,135 @@
+import json
+
+from .dispatcher import Instructions
+from .opcodes import *
+from . import types
+
+
+# Instructions worth profiling, specialized variants included, by their generic name
+PROFILED = {
+    "OP_ADD": "OP_ADD",
+    "OP_ADD_NUM": "OP_ADD",
+    "OP_ADD_STR": "OP_ADD",
+    "OP_SUBTRACT": "OP_SUBTRACT",
+    "OP_SUBTRACT_NUM": "OP_SUBTRACT",
+    "OP_MULTIPLY": "OP_MULTIPLY",
+    "OP_MULTIPLY_NUM": "OP_MULTIPLY",
+    "OP_DIVIDE": "OP_DIVIDE",
+    "OP_DIVIDE_NUM": "OP_DIVIDE",
+    "OP_GREATER": "OP_GREATER",
+    "OP_GREATER_NUM": "OP_GREATER",
+    "OP_LESS": "OP_LESS",
+    "OP_LESS_NUM": "OP_LESS",
+    "OP_GET_GLOBAL": "OP_GET_GLOBAL",
+    "OP_GET_GLOBAL_CACHED": "OP_GET_GLOBAL",
+}
+
+NUMBERS = ("number", "number")
+
+# What a generic instruction becomes, given the only operand types it saw
+SPECIALIZATIONS = {
+    ("OP_ADD", NUMBERS): OP_ADD_NUM,
+    ("OP_ADD", ("string", "string")): OP_ADD_STR,
+    ("OP_SUBTRACT", NUMBERS): OP_SUBTRACT_NUM,
+    ("OP_MULTIPLY", NUMBERS): OP_MULTIPLY_NUM,
+    ("OP_DIVIDE", NUMBERS): OP_DIVIDE_NUM,
+    ("OP_GREATER", NUMBERS): OP_GREATER_NUM,
+    ("OP_LESS", NUMBERS): OP_LESS_NUM,
+}
+
+
+def kind(value):
+    if value is None:
+        return "nil"
+    elif value is True or value is False:
+        return "bool"
+    elif isinstance(value, float):
+        return "number"
+    elif isinstance(value, types.LoxString):
+        return "string"
+    else:
+        return "object"
+
+
+class TypeProfile:
+    """ Operand types seen by each profiled instruction of a script.
+
+    Sites are keyed by their offset in the chunk, and checked against the
+    instruction and source line found there: a profile recorded on another
+    version of the script only misses some specializations. Wrong ones are
+    harmless anyway, since specialized instructions keep their guards.
+    """
+    def __init__(self):
+        # offset -> (line, generic instruction name, set of operand kinds)
+        self.sites = {}
+
+    def record(self, offset, line, instr_name, kinds):
+        site = self.sites.get(offset)
+        if site is None or site[:2] != (line, instr_name):
+            self.sites[offset] = (line, instr_name, {kinds})
+        else:
+            site[2].add(kinds)
+
+    def specialize(self, offset, line, opcode):
+        """ The opcode to emit at `offset` instead of the generic `opcode` """
+        site = self.sites.get(offset)
+        instr_name = OPCODES[opcode]
+        if site is None or site[:2] != (line, instr_name):
+            return opcode
+
+        if instr_name == "OP_GET_GLOBAL":
+            # Whatever its type, the global was there
+            return OP_GET_GLOBAL_CACHED
+
+        if len(site[2]) != 1:
+            return opcode
+
+        kinds, = site[2]
+        return SPECIALIZATIONS.get((instr_name, kinds), opcode)
+
+    def save(self, path):
+        sites = {
+            str(offset): {"line": line, "op": instr_name, "types": sorted(",".join(k) for k in kinds)}
+            for offset, (line, instr_name, kinds) in sorted(self.sites.items())
+        }
+        with open(path, "w", encoding="utf8") as f:
+            json.dump({"sites": sites}, f)
+
+    @classmethod
+    def load(cls, path):
+        profile = cls()
+        with open(path, encoding="utf8") as f:
+            sites = json.load(f)["sites"]
+
+        for offset, site in sites.items():
+            kinds = {tuple(k.split(",")) for k in site["types"]}
+            profile.sites[int(offset)] = (site["line"], site["op"], kinds)
+
+        return profile
+
+
+class ProfilingInstructions(Instructions):
+    """ Instructions recording the operand types of the script into a TypeProfile as it runs """
+    def __init__(self, profile):
+        self.profile = profile
+
+    def dispatch(self, instr_name, vm):
+        generic = PROFILED.get(instr_name)
+        # Only the script is compiled from the profile: the offsets of
+        # imported modules would land on its sites
+        if generic is None or vm.module_path != vm.script_path:
+            return super().dispatch(instr_name, vm)
+
+        site = vm.ip - 1
+        line = vm.chunk.lines[site]
+        if generic == "OP_GET_GLOBAL":
+            # The type of what was read, when it could be
+            ret = super().dispatch(instr_name, vm)
+            if ret is None:
+                self.profile.record(site, line, generic, (kind(vm.stack.peek()),))
+
+            return ret
+
+        kinds = (kind(vm.stack.peek(1)), kind(vm.stack.peek()))
+        self.profile.record(site, line, generic, kinds)
+        return super().dispatch(instr_name, vm)
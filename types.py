@@ -1,40 +1,103 @@
+import struct
+import weakref
 from array import array
 from copy import copy
 from enum import Enum, auto
+from itertools import repeat
+from operator import add, mul
 
+from .exceptions import LoxRuntimeError
 from . import hashmap
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class LoxTypes(Enum):
     OBJECT = auto()
     STRING = auto()
+    NATIVE = auto()
+    ARRAY = auto()
+    MAP = auto()
 
 
 class LoxObject:
     type = LoxTypes.OBJECT
+    # The MemoryAccount this object was charged to, and how much
+    _account = None
+    _charged = 0
+
+    def __del__(self):
+        if self._account is not None:
+            self._account.release(self._charged)
 
 
 class LoxString(LoxObject):
     type = LoxTypes.STRING
 
     def __init__(self, s=""):
-        self.buffer = array('B')
+        self._buffer = array('B')
+        # A concatenation result is a rope: a run of buffers, shared with
+        # the strings it was built from, which is only joined when needed
+        self._parts = None
+        self._nparts = 0
         self.length = 0
+        self.interned = False
+        # Computed on first use: most strings never end up as keys
+        self._hash = None
         if s:
             self.populate(s)
 
-        self.hash = hashmap.fnv1a(self.buffer)
-
     def populate(self, s):
+        if s.isascii():
+            self._buffer.frombytes(s.encode("ascii"))
+            self.length += len(s)
+            return
+
         for cp in s:
             n = ord(cp)
             if n > 0x7F:
                 self._encode(n)
             else:
-                self.buffer.append(n)
+                self._buffer.append(n)
 
             self.length += 1
 
+    @property
+    def buffer(self):
+        if self._parts is not None:
+            self._flatten()
+
+        return self._buffer
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = hashmap.hash_bytes(self.buffer)
+
+        return self._hash
+
+    @property
+    def nbytes(self):
+        if self._parts is not None:
+            return self._nbytes
+
+        return len(self._buffer)
+
+    @property
+    def is_rope(self):
+        return self._parts is not None
+
+    def _flatten(self):
+        buffer = array('B')
+        for i in range(self._nparts):
+            buffer.extend(self._parts[i])
+
+        self._buffer = buffer
+        self._parts = None
+
     # def index(self, idx):
     #     i = 0
     #     actual = 0
@@ -50,27 +113,28 @@ class LoxString(LoxObject):
     #         i += 3 if c & 0x80 else 1
     #         actual += 1
 
-    def merge(self, other):
-        self.buffer += other.buffer
-        self.length += other.length
-
     def _encode(self, value):
-        self.buffer.append(((value & 0xFF0000) >> 16) | 0x80) # Mark as Unicode character start
-        self.buffer.append((value & 0xFF00) >> 8)
-        self.buffer.append(value & 0xFF)
+        self._buffer.append(((value & 0xFF0000) >> 16) | 0x80) # Mark as Unicode character start
+        self._buffer.append((value & 0xFF00) >> 8)
+        self._buffer.append(value & 0xFF)
 
     def _decode(self, hunk):
         padded = bytes((hunk[2], hunk[1], hunk[0] & 0x7F, 0))
         return padded.decode("utf-32-le")
 
     def __str__(self):
+        buffer = self.buffer
+        raw = buffer.tobytes()
+        if raw.isascii():
+            return raw.decode("ascii")
+
         chars = []
         i = 0
-        top = len(self.buffer)
+        top = len(buffer)
         while i < top:
-            c = self.buffer[i]
+            c = buffer[i]
             if c & 0x80:
-                dec = self._decode(self.buffer[i:i+3])
+                dec = self._decode(buffer[i:i+3])
                 i += 3
             else:
                 dec = chr(c)
@@ -82,13 +146,248 @@ class LoxString(LoxObject):
 
     def __eq__(self, other):
         if isinstance(other, LoxString):
-            return all([self.length == other.length, self.hash == other.hash,
-                self.buffer == other.buffer])
+            return self.length == other.length and self.buffer == other.buffer
         else:
             return self.buffer == other
 
+    def __hash__(self):
+        return self.hash
+
     def __add__(self, other):
         new = LoxString()
-        new.merge(self)
-        new.merge(other)
+        # If we're the newest string built on our parts, the new one can
+        # just append to them. This is what keeps `s = s + x;` loops linear
+        if self._parts is not None and len(self._parts) == self._nparts:
+            parts = self._parts
+        else:
+            parts = [self.buffer]
+
+        parts.append(other.buffer)
+        new._parts = parts
+        new._nparts = len(parts)
+        new.length = self.length + other.length
+        new._nbytes = self.nbytes + other.nbytes
         return new
+
+
+def _ndarray(values):
+    # A view on the same memory, no copy
+    return numpy.frombuffer(values, dtype=numpy.float64)
+
+
+class LoxArray(LoxObject):
+    """ Array of numbers, stored contiguously.
+
+    Bulk operations run over the whole buffer at once: through NumPy when
+    it's installed, else through the C loops behind the builtins.
+    """
+    type = LoxTypes.ARRAY
+
+    def __init__(self, values=None):
+        self.values = values if values is not None else array('d')
+
+    @classmethod
+    def filled(cls, size, fill=0.0):
+        return cls(array('d', [fill]) * size)
+
+    def sum(self):
+        if numpy is not None and self.values:
+            return float(_ndarray(self.values).sum())
+
+        return float(sum(self.values))
+
+    def dot(self, other):
+        if numpy is not None and self.values:
+            return float(numpy.dot(_ndarray(self.values), _ndarray(other.values)))
+
+        return float(sum(map(mul, self.values, other.values)))
+
+    def scale(self, factor):
+        if numpy is not None and self.values:
+            return LoxArray(array('d', (_ndarray(self.values) * factor).tobytes()))
+
+        return LoxArray(array('d', map(mul, self.values, repeat(factor))))
+
+    def add(self, other):
+        if numpy is not None and self.values:
+            result = _ndarray(self.values) + _ndarray(other.values)
+            return LoxArray(array('d', result.tobytes()))
+
+        return LoxArray(array('d', map(add, self.values, other.values)))
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self):
+        return len(self.values) * self.values.itemsize
+
+    def __str__(self):
+        return "[" + ", ".join(f"{v:g}" for v in self.values) + "]"
+
+    def index(self, index):
+        # The range check first: it also rules out infinities and NaN, which int() can't take
+        if not isinstance(index, float) or not 0 <= index < len(self.values) or index != int(index):
+            raise LoxRuntimeError("Array index out of range.")
+
+        return int(index)
+
+    def get(self, index):
+        return self.values[self.index(index)]
+
+    def set(self, index, value):
+        if not isinstance(value, float):
+            raise LoxRuntimeError("Arrays can only hold numbers.")
+
+        self.values[self.index(index)] = value
+
+
+class LoxMap(LoxObject):
+    """ Map from strings, numbers and booleans to any value, on a HashMap.
+
+    Strings are keys as they are. Numbers and booleans are encoded to bytes,
+    which never equal a LoxString: true and 1 stay different keys, as Lox
+    wants them.
+    """
+    type = LoxTypes.MAP
+
+    def __init__(self):
+        # Filling a big map mustn't stall on one of its resizes
+        self.table = hashmap.HashMap(incremental=True)
+
+    @staticmethod
+    def encode(key):
+        if isinstance(key, LoxString):
+            return key
+        elif key is True or key is False:
+            return b"b\x01" if key else b"b\x00"
+        elif isinstance(key, float):
+            # -0 and 0 are equal, they must be the same key
+            return b"n" + struct.pack("<d", key + 0.0)
+
+        raise LoxRuntimeError("Map keys must be strings, numbers or booleans.")
+
+    @staticmethod
+    def decode(key):
+        if isinstance(key, LoxString):
+            return key
+        elif key[0] == ord("b"):
+            return key == b"b\x01"
+
+        return struct.unpack("<d", key[1:])[0]
+
+    def get(self, key):
+        return self.table.get(self.encode(key))
+
+    def set(self, key, value):
+        self.table.insert(self.encode(key), value)
+
+    def contains(self, key):
+        return self.table.contains(self.encode(key))
+
+    def remove(self, key):
+        self.table.remove(self.encode(key))
+
+    def key_at(self, position):
+        """ Keys sit at dense positions, which removals reorder """
+        return self.decode(self.table.keys[position])
+
+    def items(self):
+        return ((self.decode(key), value) for key, value in self.table.items())
+
+    def __len__(self):
+        return self.table.count
+
+    @property
+    def nbytes(self):
+        # The indices, plus a hash, key and value pointer per entry
+        indices = self.table.indices
+        return len(indices) * indices.itemsize + 24 * self.table.count
+
+
+class LoxNative(LoxObject):
+    """ Python function callable from Lox.
+
+    It's given Lox values, and returns one or a Python value that
+    program.to_lox converts. `arity` is the number of arguments it takes,
+    or None if it takes any.
+    """
+    type = LoxTypes.NATIVE
+
+    def __init__(self, name, function, arity=None):
+        self.name = name
+        self.function = function
+        self.arity = arity
+
+    def __str__(self):
+        return f"<native fn {self.name}>"
+
+
+class _StringRef(weakref.ref):
+    """ Weak reference to an interned string, standing for it as a table key """
+    __slots__ = ("hash",)
+
+    def __init__(self, string, callback):
+        super().__init__(string, callback)
+        self.hash = string.hash
+
+    def __eq__(self, other):
+        if isinstance(other, _StringRef):
+            other = other()
+
+        string = self()
+        return string is not None and string == other
+
+    def __hash__(self):
+        return self.hash
+
+
+class StringTable:
+    """ Interning table for LoxStrings, owned by the VM and shared with the compiler.
+
+    Literals and identifiers are interned here, so that those with the same
+    contents are the same object and compare by identity. Strings built at
+    runtime aren't: concatenation results (lazy ropes), natives' results and
+    values bound from Python. Hashing every one of them would cost more than
+    it saves, so OP_EQUAL compares their contents instead.
+    Strings are only weakly referenced: once no value holds them anymore,
+    their entry is released.
+    """
+    def __init__(self, table=hashmap.HashMap, account=None):
+        self.table = table()
+        # The MemoryAccount new strings are charged to, if any
+        self.account = account
+
+    def intern(self, s):
+        return self._intern(LoxString(s))
+
+    def concat(self, a, b):
+        # Interning needs the hash, hence the whole contents: concatenation
+        # results are left as uninterned ropes
+        if self.account is not None:
+            return self.account.adopt(a + b)
+
+        return a + b
+
+    def _intern(self, candidate):
+        ref = self.table.get(candidate)
+        if ref is not None:
+            string = ref()
+            if string is not None:
+                return string
+
+        if self.account is not None:
+            self.account.adopt(candidate)
+
+        candidate.interned = True
+        ref = _StringRef(candidate, self._release)
+        self.table.insert(ref, ref)
+        return candidate
+
+    def _release(self, ref):
+        # A dead reference only ever equals itself
+        self.table.remove(ref)
+
+    @property
+    def count(self):
+        return self.table.count
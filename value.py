@@ -1,25 +1,49 @@
+import threading
 from array import array
 
-from .exceptions import LoxStackOverflow, LoxTooManyLocals
+from .exceptions import LoxTooManyLocals
 from . import types
 
 
-def print_value(value, end=""):
-    out = None
-
+def format_value(value):
     if value is None:
-        out = "nil"
+        return "nil"
     elif value is True or value is False:
-        out = str(value).lower()
+        return str(value).lower()
     elif isinstance(value, float):
-        out = f"{value:g}"
-    elif isinstance(value, types.LoxString):
-        out = str(value)
+        return f"{value:g}"
+    elif isinstance(value, (types.LoxString, types.LoxNative, types.LoxArray)):
+        return str(value)
+    elif isinstance(value, types.LoxMap):
+        return _format_map(value)
     else:
-        out = f"??? {value}"
+        return f"??? {value}"
+
+
+class _Formatting(threading.local):
+    def __init__(self):
+        # Maps being formatted, so that one containing itself doesn't recurse forever
+        self.maps = set()
 
-    if out is not None:
-        print(out, end=end)
+
+_formatting = _Formatting()
+
+
+def _format_map(lmap):
+    formatting = _formatting.maps
+    if id(lmap) in formatting:
+        return "{...}"
+
+    formatting.add(id(lmap))
+    try:
+        entries = (f"{format_value(k)}: {format_value(v)}" for k, v in lmap.items())
+        return "{" + ", ".join(entries) + "}"
+    finally:
+        formatting.discard(id(lmap))
+
+
+def print_value(value, end=""):
+    print(format_value(value), end=end)
 
 
 class ValueArray:
@@ -34,6 +58,10 @@ class ValueArray:
         self.values.append(byte)
         self._count += 1
 
+    def truncate(self, count):
+        del self.values[count:]
+        self._count = count
+
     @property
     def count(self):
         return self._count
@@ -46,12 +74,15 @@ class Stack:
         self.maxsize = maxsize
 
     def push(self, val):
-        if self.stack_top == self.maxsize:
-            raise LoxStackOverflow
-
+        # Unchecked: the VM checks for overflows after every instruction,
+        # unless the code was verified not to overflow
         self.stack.append(val)
         self.stack_top += 1
 
+    @property
+    def overflowed(self):
+        return self.stack_top > self.maxsize
+
     def pop(self):
         self.stack_top -= 1
         return self.stack.pop()
@@ -60,6 +91,8 @@ class Stack:
         return self.stack[-1 - distance]
 
     def reset(self):
+        # Values left over by an error would shift the slots of locals
+        self.stack.clear()
         self.stack_top = 0
 
     def __iter__(self):
@@ -67,9 +100,15 @@ class Stack:
 
 
 class Locals:
+    """ Locals in scope, by stack slot, along with the depth of their scope.
+
+    `slots` maps each name to the slots declared under it, innermost last:
+    resolving a name, shadowing included, doesn't need to scan the locals.
+    """
     def __init__(self):
         self.locals = []
         self.depth = []
+        self.slots = {}
         self.scope_depth = 0
         self.count = 0
 
@@ -82,9 +121,30 @@ class Locals:
             raise LoxTooManyLocals
 
         self.locals.append(name)
+        self.slots.setdefault(name.lexeme, []).append(self.count)
         self.count += 1
         self.depth.append(-1 if uninitialized else self.scope_depth)
 
+    def pop(self):
+        name = self.locals.pop()
+        self.depth.pop()
+        slots = self.slots[name.lexeme]
+        slots.pop()
+        if not slots:
+            del self.slots[name.lexeme]
+
+        self.count -= 1
+
+    def resolve(self, lexeme):
+        """ The slot of the innermost local named `lexeme`, -1 if there's none """
+        slots = self.slots.get(lexeme)
+        return slots[-1] if slots else -1
+
+    def declared_in_scope(self, lexeme):
+        slot = self.resolve(lexeme)
+        # Only the one being declared isn't initialized yet, and it's in the current scope
+        return slot != -1 and self.depth[slot] in (-1, self.scope_depth)
+
     def initialize_current(self):
         self.depth[self.count - 1] = self.scope_depth
 
@@ -0,0 +1,138 @@
+from .opcodes import *
+from .exceptions import LoxVerifyError
+from . import types
+
+
+# Opcode -> bytes of operand after it
+OPERAND_SIZES = {
+    **{globals()[name]: 0 for name in OPCODES_SIMPLE},
+    **{globals()[name]: 1 for name in (*OPCODES_CONSTANT, *OPCODES_BYTEINSTR)},
+    **{globals()[name]: 2 for name in (*OPCODES_LONG, *OPCODES_JUMPINSTR)},
+}
+
+# Opcode -> (values it needs on the stack, how much it grows the stack),
+# for all but OP_CALL, whose effect depends on its operand
+STACK_EFFECTS = {
+    **{opcode: (2, -1) for opcode in (
+        OP_ADD, OP_SUBTRACT, OP_MULTIPLY, OP_DIVIDE, OP_EQUAL, OP_GREATER, OP_LESS,
+        OP_ADD_NUM, OP_ADD_STR, OP_SUBTRACT_NUM, OP_MULTIPLY_NUM, OP_DIVIDE_NUM,
+        OP_GREATER_NUM, OP_LESS_NUM, OP_ADD_NUM_UNCHECKED, OP_ADD_STR_UNCHECKED,
+        OP_SUBTRACT_UNCHECKED, OP_MULTIPLY_UNCHECKED, OP_DIVIDE_UNCHECKED,
+        OP_GREATER_UNCHECKED, OP_LESS_UNCHECKED, OP_GET_INDEX,
+    )},
+    **{opcode: (1, 0) for opcode in (
+        OP_NOT, OP_NEGATE, OP_NEGATE_UNCHECKED, OP_SET_LOCAL, OP_SET_GLOBAL,
+        OP_SET_GLOBAL_LONG, OP_JUMP_IF_FALSE,
+    )},
+    **{opcode: (1, -1) for opcode in (OP_PRINT, OP_POP, OP_DEFINE_GLOBAL, OP_DEFINE_GLOBAL_LONG)},
+    **{opcode: (0, 1) for opcode in (
+        OP_FALSE, OP_NIL, OP_TRUE, OP_CONSTANT, OP_CONSTANT_LONG, OP_GET_LOCAL,
+        OP_GET_GLOBAL, OP_GET_GLOBAL_CACHED, OP_GET_GLOBAL_LONG,
+    )},
+    **{opcode: (0, 0) for opcode in (OP_IMPORT, OP_IMPORT_LONG, OP_JUMP, OP_LOOP, OP_RETURN)},
+    OP_SET_INDEX: (3, -2),
+}
+
+# Instructions whose operand names a global, or a module, as a string constant
+NAMED = {
+    OP_GET_GLOBAL, OP_GET_GLOBAL_CACHED, OP_GET_GLOBAL_LONG, OP_DEFINE_GLOBAL,
+    OP_DEFINE_GLOBAL_LONG, OP_SET_GLOBAL, OP_SET_GLOBAL_LONG, OP_IMPORT, OP_IMPORT_LONG,
+}
+
+
+def verify(cnk):
+    """ Check that `cnk` is safe to run without any check, return its maximum stack depth.
+
+    Every instruction must be a known one with its operand in the code,
+    constants and local slots in range, names strings, and jumps must land
+    on instructions. Every path must end on OP_RETURN, and reach each
+    instruction with the same number of values on the stack, never fewer
+    than it pops. Raises LoxVerifyError otherwise; the depth is also kept
+    in `cnk.max_depth`.
+    """
+    code = cnk.code
+    count = len(code)
+    if not count:
+        raise LoxVerifyError("No code.")
+
+    if len(cnk.lines) != count:
+        raise LoxVerifyError(f"{len(cnk.lines)} lines for {count} bytes of code.")
+
+    constants = cnk.constants.values
+    # Offset of each instruction -> stack depth before it
+    depths = {}
+    offset = 0
+    while offset < count:
+        opcode = code[offset]
+        size = OPERAND_SIZES.get(opcode)
+        if size is None:
+            raise LoxVerifyError(f"Invalid opcode {opcode} at {offset}.")
+
+        depths[offset] = None
+        offset += 1 + size
+
+    if offset != count:
+        raise LoxVerifyError("Code ends in the middle of an instruction.")
+
+    max_depth = 0
+    pending = [(0, 0)]
+    while pending:
+        offset, depth = pending.pop()
+        while True:
+            if offset not in depths:
+                raise LoxVerifyError(f"Jump to {offset}, not an instruction.")
+
+            seen = depths[offset]
+            if seen is not None:
+                if seen != depth:
+                    raise LoxVerifyError(f"Stack depth {depth} at {offset}, {seen} on another path.")
+                break
+
+            depths[offset] = depth
+            opcode = code[offset]
+            size = OPERAND_SIZES[opcode]
+            if size == 1:
+                operand = code[offset + 1]
+            elif size == 2:
+                operand = code[offset + 1] << 8 | code[offset + 2]
+
+            if opcode == OP_CALL:
+                needs, effect = operand + 1, -operand
+            else:
+                needs, effect = STACK_EFFECTS[opcode]
+
+            if depth < needs:
+                raise LoxVerifyError(f"{OPCODES[opcode]} at {offset} pops {needs} of {depth} values.")
+
+            if opcode in (OP_GET_LOCAL, OP_SET_LOCAL) and operand >= depth:
+                raise LoxVerifyError(f"{OPCODES[opcode]} at {offset} reads slot {operand} of {depth}.")
+
+            if opcode in NAMED or opcode in (OP_CONSTANT, OP_CONSTANT_LONG):
+                if operand >= len(constants):
+                    raise LoxVerifyError(f"{OPCODES[opcode]} at {offset} reads constant {operand} of {len(constants)}.")
+
+                if opcode in NAMED and not isinstance(constants[operand], types.LoxString):
+                    raise LoxVerifyError(f"{OPCODES[opcode]} at {offset} names a {type(constants[operand]).__name__}.")
+
+            depth += effect
+            max_depth = max(max_depth, depth)
+            if opcode == OP_RETURN:
+                break
+
+            next_offset = offset + 1 + size
+            if opcode == OP_LOOP:
+                offset = next_offset - operand
+                continue
+            elif opcode == OP_JUMP:
+                offset = next_offset + operand
+                continue
+            elif opcode == OP_JUMP_IF_FALSE:
+                pending.append((next_offset + operand, depth))
+
+            if next_offset == count:
+                raise LoxVerifyError(f"{OPCODES[opcode]} at {offset} runs off the end of the code.")
+
+            offset = next_offset
+
+    cnk.max_depth = max_depth
+    return max_depth
@@ -1,20 +1,130 @@
 from .opcodes import *
+from .coverage import CoverageInstructions
 from .enums import VMResult
 from .error_machinery import ErrorMachinery
-from . import compiler, chunk, dispatcher, hashmap, value
+from .exceptions import LoxCompileError, LoxMemoryError, LoxRuntimeError, LoxVerifyError
+from . import compiler, chunk, dispatcher, hashmap, memory, modules, natives, program, types, typeprofile, value, verifier
 from . import debug
 
 
-errmac = ErrorMachinery()
-
-
 class VM:
-    def __init__(self):
+    def __init__(self, table="dict", profile=None, infer=False, quota=None):
+        # The tables behind globals and interning: "hashmap" is our own
+        # reference implementation, "dict" the built-in one
+        table = hashmap.BACKENDS[table]
+        # What this VM allocates, and at most how many bytes of it may be live
+        self.memory = memory.MemoryAccount(quota)
+        self.memory.locate = self.current_line
+        # Bytes charged for the constant pool of the current chunk
+        self.pool_charge = 0
+        # The chunk interactive inputs are appended to, see `interpret_incremental`
+        self.session = None
+        # Everything a VM changes is its own, so that VMs can run side by side in threads
+        self.errors = ErrorMachinery()
+        self.trace_execution = debug.TRACE_EXECUTION
         self.stack = value.Stack()
-        self.compiler = compiler.Compiler()
-        self.globals = hashmap.HashMap()
+        self.strings = types.StringTable(table, self.memory)
+        self.compiler = compiler.Compiler(self.strings, profile, infer, self.errors)
+        # Imported modules: they get their own chunks, and no profile made for the script
+        self.module_compiler = compiler.Compiler(self.strings, None, infer, self.errors)
+        # Path of the module running, None for a script without a file
+        self.module_path = None
+        # Path of the script that imports them, None without a file
+        self.script_path = None
+        # Path -> chunk of every module imported so far
+        self.modules = {}
+        # Whether imported modules are compiled through the bytecode cache
+        self.module_cache = True
+        # The Program last run, and the copy of its chunk it ran
+        self.prepared = None
+        self.globals = table()
         self.instructions = dispatcher.Instructions()
+        # The Instructions last run in the fast loop, and its handlers by opcode
+        self.handlers = None
         self.init()
+        for name, (function, arity) in natives.NATIVES.items():
+            self.define_native(name, function, arity)
+
+    def define_native(self, name, function, arity=None):
+        """ Make the Python `function` callable from Lox as the global `name` """
+        native = types.LoxNative(name, function, arity)
+        if not self.globals.insert(self.strings.intern(name), native):
+            self.memory.charge(memory.GLOBAL_SIZE)
+
+    def define_global(self, name, val):
+        """ Bind the global `name` to the Python object `val`, as a Lox value.
+
+        `name` may be a LoxString interned here already, to save looking it up.
+        """
+        val = program.to_lox(val, self.memory)
+        if not isinstance(name, types.LoxString):
+            name = self.strings.intern(name)
+
+        if not self.globals.insert(name, val):
+            self.memory.charge(memory.GLOBAL_SIZE)
+
+    def prepare(self, source, path=None):
+        """ Compile `source` into a Program, to `execute` any number of times.
+
+        Its constant pool is charged to this VM until the Program is collected.
+        """
+        cnk = chunk.Chunk()
+        echo, self.errors.echo = self.errors.echo, False
+        try:
+            self.errors.reset()
+            error = self._compile(source, cnk)
+            if error is VMResult.COMPILE_ERROR:
+                raise LoxCompileError("\n".join(self.errors.messages))
+            elif error is not None:
+                # Out of memory
+                raise LoxRuntimeError("\n".join(self.errors.messages))
+        finally:
+            self.errors.echo = echo
+
+        return program.Program(cnk, self.strings, path, self.memory)
+
+    def execute(self, prog, bindings=None, result=None):
+        """ Run the Program `prog`, with the globals in the mapping `bindings` defined first.
+
+        Returns the global named `result` as a Python object, or all the
+        globals but the natives as a dict. Errors raise LoxRuntimeError.
+        Globals are left in place: running again on the same VM sees them.
+        """
+        self.run_program(prog, bindings)
+        return program.results(self, result)
+
+    def run_program(self, prog, bindings=None):
+        """ `execute` without collecting any result """
+        echo, self.errors.echo = self.errors.echo, False
+        try:
+            self.errors.reset()
+            for name, val in (bindings or {}).items():
+                self.define_global(name, val)
+
+            # Runs of the same program reuse its copy, quickened instructions included
+            if self.prepared is None or self.prepared[0] is not prog:
+                self.prepared = (prog, prog.instance(self.strings))
+
+            self.chunk = self.prepared[1]
+            self.ip = 0
+            self._enter_script(prog.path, prog.chunk)
+            self.stack.reset()
+            ret = self.run()
+        except LoxMemoryError as e:
+            raise LoxRuntimeError(str(e))
+        finally:
+            self.errors.echo = echo
+
+        if ret is not True:
+            raise LoxRuntimeError("\n".join(self.errors.messages))
+
+    def record_profile(self, profile):
+        """ Record the operand types met while running into `profile` """
+        self.instructions = typeprofile.ProfilingInstructions(profile)
+
+    def record_coverage(self, coverage):
+        """ Count every instruction run into the Coverage `coverage`, on top of any profiling """
+        self.instructions = CoverageInstructions(coverage, self.instructions)
 
     def init(self):
         self.chunk = None
@@ -32,27 +142,184 @@ class VM:
         debug.disasm_instruction(self.chunk, self.ip)
 
     def run(self):
+        if (self.chunk.max_depth is not None and not self.trace_execution
+                and type(self.instructions) is dispatcher.Instructions
+                and self.stack.stack_top + self.chunk.max_depth <= self.stack.maxsize):
+            return self._run_verified()
+
         while True:
-            if debug.TRACE_EXECUTION:
+            if self.trace_execution:
                 self.trace()
 
             instr = self.next_instruction()
-            instr_name = OPCODES[instr]
-            if instr_name is not None:
-                ret = self.instructions.dispatch(instr_name, self)
+            if instr >= len(OPCODES):
+                self.runtime_error(f"Invalid opcode {instr}.")
+                return VMResult.RUNTIME_ERROR
+
+            try:
+                ret = self.instructions.dispatch(OPCODES[instr], self)
+            except LoxMemoryError as e:
+                self.runtime_error(str(e))
+                return VMResult.RUNTIME_ERROR
+
+            if ret is not None:
+                return ret
+
+            if self.stack.overflowed:
+                self.runtime_error("Stack overflow.")
+                return VMResult.RUNTIME_ERROR
+
+    def _run_verified(self):
+        """ `run` for verified code: its opcodes are valid, and the stack has room for it """
+        if self.handlers is None or self.handlers[0] is not self.instructions:
+            self.handlers = self.instructions, [getattr(self.instructions, name) for name in OPCODES]
+
+        handlers = self.handlers[1]
+        # Imports switch chunks, but only return here once they switched back
+        code = self.chunk.code
+        try:
+            while True:
+                instr = code[self.ip]
+                self.ip += 1
+                ret = handlers[instr](self)
                 if ret is not None:
                     return ret
-            else:
-                # TODO: report invalid instruction
-                pass
+        except LoxMemoryError as e:
+            self.runtime_error(str(e))
+            return VMResult.RUNTIME_ERROR
+
+    def interpret(self, source, path=None):
+        self._enter_script(path)
+        self.memory.release(self.pool_charge)
+        self.pool_charge = 0
+        self.chunk = None
+        cnk = chunk.Chunk()
+        error = self._compile(source, cnk)
+        if error is not None:
+            return error
 
-    def interpret(self, source):
-        self.chunk = chunk.Chunk()
-        if not self.compiler.compile(source, self.chunk):
-            return VMResult.COMPILE_ERROR
+        self.pool_charge = cnk.constants.count * memory.CONSTANT_SIZE
+        error = self._verify(cnk)
+        if error is not None:
+            return error
 
+        cnk.freeze()
+        self._enter_script(path, cnk)
+        self.chunk = cnk.instance()
         return self.run()
 
+    def _enter_script(self, path, cnk=None):
+        # The script counts as imported: a module importing it back doesn't run it again
+        self.module_path = self.script_path = path
+        if path is not None:
+            self.modules[modules.resolve(path)] = cnk
+
+    def interpret_incremental(self, source):
+        """ Run `source` as the continuation of the previous inputs, for the REPL.
+
+        Its code is appended to a session chunk, whose constants (hence
+        identifiers) and instruction caches are shared by all inputs.
+        Inputs that fail to compile leave no trace in it.
+        """
+        if self.session is None:
+            self.session = chunk.Chunk()
+
+        start = self.session.count
+        error = self._compile(source, self.session)
+        if error is not None:
+            return error
+
+        self.chunk = self.session
+        self.ip = start
+        self.module_path = self.script_path = None
+        self.stack.reset()
+        return self.run()
+
+    def import_module(self, path):
+        """ Run module `path`, relative to the running one, unless it already was """
+        path = modules.resolve(path, self.module_path)
+        if path in self.modules:
+            return None
+
+        # Marked before running: import cycles stop there
+        self.modules[path] = None
+        caller = self.chunk, self.ip, self.module_path
+        ret = VMResult.RUNTIME_ERROR
+        try:
+            ret = self._run_module(path)
+            return ret
+        finally:
+            self.chunk, self.ip, self.module_path = caller
+            # A module that failed can be imported again, once fixed
+            if ret is not None:
+                del self.modules[path]
+
+    def _run_module(self, path):
+        cnk = self._load_module(path)
+        if not isinstance(cnk, chunk.Chunk):
+            return cnk
+
+        cnk.freeze()
+        self.modules[path] = cnk
+        self.chunk, self.ip, self.module_path = cnk.instance(), 0, path
+        ret = self.run()
+        return None if ret is True else ret
+
+    def _load_module(self, path):
+        try:
+            source = modules.read_source(path)
+        except OSError:
+            self.runtime_error(f"Can't read module '{path}'.")
+            return VMResult.RUNTIME_ERROR
+
+        key = modules.source_key(source, self.module_compiler.infer)
+        if self.module_cache:
+            cnk = modules.read_cache(path, key, self.strings)
+            if cnk is not None:
+                self.memory.charge(cnk.constants.count * memory.CONSTANT_SIZE)
+                return cnk
+
+        cnk = chunk.Chunk()
+        error = self._compile(source, cnk, module=True) or self._verify(cnk)
+        if error is not None:
+            return error
+
+        if self.module_cache:
+            modules.write_cache(path, key, cnk, self.module_compiler.imports)
+
+        return cnk
+
+    def _compile(self, source, cnk, module=False):
+        """ Compile `source` at the end of `cnk`, returning a VMResult on errors """
+        mark = cnk.mark()
+        try:
+            if not (self.module_compiler if module else self.compiler).compile(source, cnk):
+                cnk.rollback(mark)
+                return VMResult.COMPILE_ERROR
+
+            self.memory.charge((cnk.constants.count - mark[1]) * memory.CONSTANT_SIZE)
+        except LoxMemoryError as e:
+            cnk.rollback(mark)
+            self.errors.runtime_error(str(e))
+            return VMResult.RUNTIME_ERROR
+
+        return None
+
+    def _verify(self, cnk):
+        """ Verify `cnk`, for the fast loop, returning a VMResult if it isn't safe to run """
+        try:
+            verifier.verify(cnk)
+        except LoxVerifyError as e:
+            self.errors.runtime_error(f"Invalid bytecode: {e}")
+            return VMResult.RUNTIME_ERROR
+
+        if cnk.max_depth > self.stack.maxsize:
+            self.errors.runtime_error(
+                f"Stack overflow: the code needs {cnk.max_depth} stack slots, only {self.stack.maxsize} are available.")
+            return VMResult.RUNTIME_ERROR
+
+        return None
+
     def next_instruction(self):
         instr = self.chunk.code[self.ip]
         self.ip += 1
@@ -66,7 +333,15 @@ class VM:
         self.ip += 1
         return val
 
+    def current_line(self):
+        """ The source line being run, None while compiling """
+        if self.chunk is None:
+            return None
+
+        return self.chunk.lines[self.ip - 1]
+
     def runtime_error(self, message):
         line = self.chunk.lines[self.ip - 1]
-        message = f"{message}\n[line {line}] in script"
-        errmac.runtime_error(message)
+        where = "script" if self.module_path == self.script_path else f"module '{self.module_path}'"
+        message = f"{message}\n[line {line}] in {where}"
+        self.errors.runtime_error(message)